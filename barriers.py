@@ -0,0 +1,125 @@
+"""Arcs that cross a barrier (river, highway) drawn as GeoJSON polylines"""
+from __future__ import print_function
+import os
+import json
+
+import lazy_imports
+
+np = lazy_imports.module("numpy")
+
+# GeoJSON file of LineString / MultiLineString / Polygon / MultiPolygon
+# barriers; without it the cluster costs fall back to the distance heuristic
+BARRIER_FILE = os.environ.get("BARRIER_FILE", "")
+# consecutive segments of a polyline share one bounding box in the index
+CHUNK_SEGMENTS = 16
+# arcs tested against a chunk at a time, bounds the (arcs, segments) arrays
+BATCH_ARCS = 1 << 16
+
+# path -> (modification time, chunks), loaded once per warm container
+_loaded = {}
+
+############
+# Barriers #
+############
+def _lines(geometry):
+    """The coordinate lists of every line of a GeoJSON geometry"""
+    kind = geometry.get("type")
+    coordinates = geometry.get("coordinates", [])
+    if kind == "LineString":
+        return [coordinates]
+    if kind in ("MultiLineString", "Polygon"):
+        return list(coordinates)
+    if kind == "MultiPolygon":
+        return [ring for polygon in coordinates for ring in polygon]
+    if kind == "GeometryCollection":
+        return [line for part in geometry.get("geometries", []) for line in _lines(part)]
+    return []
+
+def _geometries(geojson):
+    if geojson.get("type") == "FeatureCollection":
+        return [feature.get("geometry") or {} for feature in geojson.get("features", [])]
+    if geojson.get("type") == "Feature":
+        return [geojson.get("geometry") or {}]
+    return [geojson]
+
+def chunk_segments(geojson, size=CHUNK_SEGMENTS):
+    """Cuts the barrier lines into chunks of up to size segments.
+
+    Returns a list of (low, high, segments): the (lng, lat) bounding box of
+    the chunk and its (S, 4) array of x1, y1, x2, y2 segments.
+    """
+    chunks = []
+    for geometry in _geometries(geojson):
+        for line in _lines(geometry):
+            points = np.array([point[:2] for point in line], dtype=np.float64).reshape(-1, 2)
+            if len(points) < 2:
+                continue
+            segments = np.hstack((points[:-1], points[1:]))
+            for start in range(0, len(segments), size):
+                chunk = segments[start:start + size]
+                ends = chunk.reshape(-1, 2)
+                chunks.append((ends.min(axis=0), ends.max(axis=0), chunk))
+    return chunks
+
+def load(path=None):
+    """Returns the chunks of the barrier file, None if there is none"""
+    path = BARRIER_FILE if path is None else path
+    if not path:
+        return None
+    modified = os.path.getmtime(path)
+    if path not in _loaded or _loaded[path][0] != modified:
+        with open(path) as f:
+            chunks = chunk_segments(json.load(f))
+        print("Loaded " + str(sum(len(chunk[2]) for chunk in chunks)) + " barrier segments from " + path)
+        _loaded[path] = (modified, chunks)
+    return _loaded[path][1]
+
+def _cross(first, second, segments):
+    """Whether first[k] -> second[k] properly crosses any of the segments"""
+    def orientation(ax, ay, bx, by, cx, cy):
+        return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+    ax, ay = first[:, 0, None], first[:, 1, None]
+    bx, by = second[:, 0, None], second[:, 1, None]
+    cx, cy, dx, dy = segments[None, :, 0], segments[None, :, 1], segments[None, :, 2], segments[None, :, 3]
+    # the ends of each must lie strictly on both sides of the other
+    return ((orientation(ax, ay, bx, by, cx, cy) * orientation(ax, ay, bx, by, dx, dy) < 0)
+            & (orientation(cx, cy, dx, dy, ax, ay) * orientation(cx, cy, dx, dy, bx, by) < 0)).any(axis=1)
+
+def crossing_arcs(locations, chunks):
+    """Returns the symmetric N x N mask of the arcs that cross a barrier.
+
+    For each chunk, a location gets an outcode of where it lies around the
+    chunk's box (left, right, below, above); only the arcs whose ends share
+    no side can reach the box, and only those are tested segment by segment.
+    """
+    size = len(locations)
+    crosses = np.zeros((size, size), dtype=bool)
+    if size < 2 or not chunks:
+        return crosses
+    # GeoJSON is (lng, lat); crossing is unchanged by the aspect of the axes
+    points = np.array([[loc[1], loc[0]] for loc in locations], dtype=np.float64)
+    for low, high, segments in chunks:
+        codes = ((points[:, 0] < low[0]) * 1 | (points[:, 0] > high[0]) * 2
+                 | (points[:, 1] < low[1]) * 4 | (points[:, 1] > high[1]) * 8)
+        groups = dict((code, np.flatnonzero(codes == code)) for code in np.unique(codes))
+        for first_code, first in groups.items():
+            for second_code, second in groups.items():
+                if first_code > second_code or first_code & second_code:
+                    continue
+                rows, cols = np.meshgrid(first, second, indexing="ij")
+                rows, cols = rows.reshape(-1), cols.reshape(-1)
+                if first_code == second_code:
+                    keep = rows < cols
+                    rows, cols = rows[keep], cols[keep]
+                for start in range(0, len(rows), BATCH_ARCS):
+                    batch = slice(start, start + BATCH_ARCS)
+                    found = _cross(points[rows[batch]], points[cols[batch]], segments)
+                    crosses[rows[batch][found], cols[batch][found]] = True
+    return crosses | crosses.T
+
+def crossings(locations, path=None):
+    """The crossing mask of the configured barriers, None when there are none"""
+    chunks = load(path)
+    if chunks is None:
+        return None
+    return crossing_arcs(locations, chunks)
@@ -0,0 +1,194 @@
+"""Splits very large VRP requests into sectors around the depot"""
+from __future__ import print_function
+import functools
+from collections import deque
+
+import distance_matrix
+import lazy_imports
+import search_control
+import solver_portfolio
+import vrp_constraints
+import vrp_data_problem as data_problem
+
+np = lazy_imports.module("numpy")
+
+# relocation passes over all stops after the sectors are stitched together
+REPAIR_PASSES = 3
+
+#################
+# Decomposition #
+#################
+# Stops are sorted by their angle around the depot and cut into sectors of
+# equal size, starting at the widest angular gap. Each sector is solved as
+# its own VRP with a share of the vehicles in forked processes (hard distance
+# limit first, soft for the sectors that fail), no more at a time than the
+# cores allow, and the routes are stitched together and repaired by
+# relocating stops between routes of different sectors.
+
+class SectorDistance(object):
+    """The distance evaluator of one sector, cut out of the full matrix"""
+    def __init__(self, matrix, crossings=None):
+        self._distances = matrix
+        self._crossings = crossings
+
+    def get_distance_matrix(self):
+        return self._distances
+
+    def get_cluster_distance_matrix(self):
+        return vrp_constraints.cluster_distance_matrix(self._distances, self._crossings)
+
+    def get_arc_cost_matrix(self, cluster):
+        return self.get_cluster_distance_matrix() if cluster else self._distances
+
+def sweep_sectors(locations, num_sectors):
+    """Splits the stops (nodes 1..N-1) into sectors by angle around the depot"""
+    coords = np.array([[loc[0], loc[1]] for loc in locations], dtype=np.float64)
+    depot = coords[0]
+    x = (coords[1:, 1] - depot[1]) * np.cos(np.radians(depot[0]))
+    y = coords[1:, 0] - depot[0]
+    angles = np.arctan2(y, x)
+    order = np.argsort(angles)
+    # start right after the widest gap, so no dense area is cut at -pi
+    gaps = np.diff(np.append(angles[order], angles[order[0]] + 2 * np.pi))
+    order = np.roll(order, -(int(gaps.argmax()) + 1))
+    return [sector + 1 for sector in np.array_split(order, num_sectors) if len(sector)]
+
+def share_vehicles(data, sectors):
+    """Splits the vehicles by parcels, at least as many as each sector needs.
+
+    Returns None when the sectors need more vehicles than there are.
+    """
+    capacity = max(1, data.max_parcels - data.parcels[0])
+    parcels = np.array([sum(data.parcels[node] for node in sector) for sector in sectors], dtype=np.float64)
+    needed = np.maximum(1, np.ceil(parcels / capacity)).astype(int)
+    if needed.sum() > data.num_vehicles:
+        return None
+    share = parcels / max(parcels.sum(), 1) * data.num_vehicles
+    vehicles = np.maximum(needed, np.floor(share).astype(int))
+    # hand out what is left by largest remainder, take back by smallest
+    while vehicles.sum() < data.num_vehicles:
+        vehicles[int(np.argmax(share - vehicles))] += 1
+    while vehicles.sum() > data.num_vehicles:
+        spare = np.where(vehicles > needed, share - vehicles, np.inf)
+        vehicles[int(np.argmin(spare))] -= 1
+    return vehicles.tolist()
+
+def _subproblem(data, matrix, crossings, sector, num_vehicles):
+    nodes = [data.depot] + list(sector)
+    sub_data = data_problem.DataProblem(
+        [data.locations[node] for node in nodes], num_vehicles, data.min_parcels, data.max_parcels,
+        data.maximum_distance, data.transport_mode, data.distance_calculation)
+    # the mode masks are already applied to the full matrix
+    sub_matrix = distance_matrix.DistanceMatrix(matrix.values[np.ix_(nodes, nodes)])
+    sub_crossings = crossings[np.ix_(nodes, nodes)] if crossings is not None else None
+    return sub_data, SectorDistance(sub_matrix, sub_crossings), nodes
+
+def repair(data, matrix, routes, sector_of, passes=REPAIR_PASSES):
+    """Relocates stops to routes of other sectors where that shortens the plan.
+
+    A move keeps the parcel capacity, the hard distance limit and, unless the
+    route was already short of it, min_parcels of the route it leaves.
+    """
+    values = matrix.values.astype(np.int64)
+    parcels = np.array(data.parcels, dtype=np.int64)
+    capacity = data.max_parcels - data.parcels[0]
+    routes = [list(route) for route in routes]
+
+    def plan():
+        # every arc of the plan as (from, to, route), and each route's length and load
+        paths = [[data.depot] + route + [data.depot] for route in routes]
+        arcs = np.array([(path[i], path[i + 1], r) for r, path in enumerate(paths)
+                         for i in range(len(path) - 1)], dtype=np.int64).reshape(-1, 3)
+        lengths = np.array([values[path[:-1], path[1:]].sum() for path in paths])
+        loads = np.array([parcels[route].sum() for route in routes])
+        return arcs, lengths, loads
+
+    arcs, lengths, loads = plan()
+    moved = 0
+    for _ in range(passes):
+        improved = False
+        for stop in [node for route in routes for node in route]:
+            source = next(r for r, route in enumerate(routes) if stop in route)
+            position = routes[source].index(stop)
+            path = [data.depot] + routes[source] + [data.depot]
+            before, after = path[position], path[position + 2]
+            gain = values[before, stop] + values[stop, after] - values[before, after]
+            if loads[source] - parcels[stop] < data.min_parcels <= loads[source] and len(routes[source]) > 1:
+                continue
+
+            cost = values[arcs[:, 0], stop] + values[stop, arcs[:, 1]] - values[arcs[:, 0], arcs[:, 1]]
+            target = arcs[:, 2]
+            allowed = (sector_of[target] != sector_of[source]) & (loads[target] + parcels[stop] <= capacity)
+            if data.maximum_distance != 0:
+                allowed &= lengths[target] + cost <= data.maximum_distance
+            if not allowed.any():
+                continue
+            best = int(np.argmin(np.where(allowed, cost, np.iinfo(np.int64).max)))
+            if cost[best] >= gain:
+                continue
+
+            destination = int(target[best])
+            # the arc's position in its route is its offset from the route's first arc
+            offset = best - int(np.flatnonzero(target == destination)[0])
+            routes[source].remove(stop)
+            routes[destination].insert(offset, stop)
+            arcs, lengths, loads = plan()
+            moved += 1
+            improved = True
+        if not improved:
+            break
+    print("Border repair moved " + str(moved) + " stops")
+    return routes
+
+def solve(data, distance, min_vehicles, num_sectors, time_limit_ms, create_routing_model, workers=1):
+    """Solves the sectors in parallel and returns (routes, model).
+
+    create_routing_model(data, distance, min_vehicles, soft) builds the model
+    of one sector, which is solved by a portfolio of `workers`; only as many
+    sectors as leave one core per worker are solved at a time, the others
+    wait in order. model is "soft" when a sector needed the soft distance
+    limit. Returns None when the vehicles cannot be shared out or a sector
+    has no solution.
+    """
+    sectors = sweep_sectors(data.locations, num_sectors)
+    vehicles = share_vehicles(data, sectors)
+    if vehicles is None:
+        print("Not enough vehicles to split into " + str(num_sectors) + " sectors")
+        return None
+
+    matrix = distance.get_distance_matrix()
+    crossings = distance.get_crossings()
+    subproblems = [_subproblem(data, matrix, crossings, sector, count) for sector, count in zip(sectors, vehicles)]
+    results = [None] * len(subproblems)
+    import multiprocessing
+    concurrency = max(1, multiprocessing.cpu_count() // max(1, workers))
+    model = "hard"
+    for soft in (False, True):
+        queued = deque(index for index, result in enumerate(results) if result is None)
+        if soft and queued:
+            model = "soft"
+        running = deque()
+        while queued or running:
+            while queued and len(running) < concurrency:
+                index = queued.popleft()
+                sub_data, sub_distance, nodes = subproblems[index]
+                build = functools.partial(create_routing_model, sub_data, sub_distance, min_vehicles, soft)
+                budget = search_control.time_budget_ms(
+                    sub_data.num_locations, sub_data.num_vehicles, time_limit_ms)
+                running.append((index, solver_portfolio.start(build, workers, budget)))
+            index, pending = running.popleft()
+            results[index] = pending.best()
+        if data.maximum_distance == 0:
+            break
+    if any(result is None for result in results):
+        print("A sector has no solution")
+        return None
+
+    routes = []
+    sector_of = []
+    for index, ((objective, sub_routes, configuration), (sub_data, sub_distance, nodes)) in enumerate(
+            zip(results, subproblems)):
+        for route in sub_routes:
+            routes.append([nodes[node] for node in route])
+            sector_of.append(index)
+    return repair(data, matrix, routes, np.array(sector_of)), model
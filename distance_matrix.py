@@ -0,0 +1,341 @@
+"""Vectorized distance matrix computation"""
+import lazy_imports
+import matrix_cache
+
+np = lazy_imports.module("numpy")
+
+# WGS-84 ellipsoid (km), the same model geopy's vincenty uses by default
+MAJOR = 6378.137
+MINOR = 6356.7523142
+FLATTENING = 1 / 298.257223563
+
+# same convergence settings as geopy.distance.vincenty
+ITERATIONS = 20
+CONVERGENCE = 10e-12
+
+# meters stored for pairs OSRM cannot route (null / nan), longer than any
+# real trip but far from int32 overflow when a few of them are summed
+UNREACHABLE = 10 ** 8
+
+###########################
+# Vincenty Inverse Kernel #
+###########################
+def vincenty_pairs(lat1, lng1, lat2, lng2):
+    """Returns the Vincenty distance in meters between arrays of points.
+
+    The arguments are broadcast against each other, so a single point can be
+    measured against a whole array in one call. Every pair follows the same
+    iteration as geopy's vincenty(...).meters and the results agree with it
+    to within 1e-6 meters.
+    """
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(
+        *[np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lng1, lat2, lng2)])
+    f = FLATTENING
+
+    delta_lng = lng2 - lng1
+    reduced_lat1 = np.arctan((1 - f) * np.tan(lat1))
+    reduced_lat2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_reduced1, cos_reduced1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+    sin_reduced2, cos_reduced2 = np.sin(reduced_lat2), np.cos(reduced_lat2)
+
+    lambda_lng = delta_lng.copy()
+    sin_sigma = np.zeros(delta_lng.shape)
+    cos_sigma = np.ones(delta_lng.shape)
+    sigma = np.zeros(delta_lng.shape)
+    cos_sq_alpha = np.ones(delta_lng.shape)
+    cos2_sigma_m = np.zeros(delta_lng.shape)
+
+    # pairs are frozen once they converge, so each one keeps exactly the
+    # values of its own last iteration
+    active = np.ones(delta_lng.shape, dtype=bool)
+    i = 0
+    while active.any():
+        i += 1
+        if i > ITERATIONS:
+            raise ValueError("Vincenty formula failed to converge!")
+
+        sin_lambda_lng, cos_lambda_lng = np.sin(lambda_lng), np.cos(lambda_lng)
+        new_sin_sigma = np.sqrt(
+            (cos_reduced2 * sin_lambda_lng) ** 2 +
+            (cos_reduced1 * sin_reduced2 -
+             sin_reduced1 * cos_reduced2 * cos_lambda_lng) ** 2)
+
+        # coincident points are done at distance 0
+        coincident = active & (new_sin_sigma == 0)
+        sin_sigma[coincident] = 0
+        active &= ~coincident
+        if not active.any():
+            break
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_cos_sigma = (sin_reduced1 * sin_reduced2 +
+                             cos_reduced1 * cos_reduced2 * cos_lambda_lng)
+            new_sigma = np.arctan2(new_sin_sigma, new_cos_sigma)
+            sin_alpha = cos_reduced1 * cos_reduced2 * sin_lambda_lng / new_sin_sigma
+            new_cos_sq_alpha = 1 - sin_alpha ** 2
+            # equatorial line
+            new_cos2_sigma_m = np.where(
+                new_cos_sq_alpha != 0,
+                new_cos_sigma - 2 * sin_reduced1 * sin_reduced2 / new_cos_sq_alpha,
+                0.0)
+
+        np.copyto(sin_sigma, new_sin_sigma, where=active)
+        np.copyto(cos_sigma, new_cos_sigma, where=active)
+        np.copyto(sigma, new_sigma, where=active)
+        np.copyto(cos_sq_alpha, new_cos_sq_alpha, where=active)
+        np.copyto(cos2_sigma_m, new_cos2_sigma_m, where=active)
+
+        C = f / 16. * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lambda_prime = lambda_lng
+        lambda_lng = np.where(active, delta_lng + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (
+                cos2_sigma_m + C * cos_sigma * (-1 + 2 * cos2_sigma_m ** 2))),
+            lambda_lng)
+        active &= np.abs(lambda_lng - lambda_prime) > CONVERGENCE
+
+    u_sq = cos_sq_alpha * (MAJOR ** 2 - MINOR ** 2) / MINOR ** 2
+    A = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (
+        cos2_sigma_m + B / 4. * (
+            cos_sigma * (-1 + 2 * cos2_sigma_m ** 2) -
+            B / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) *
+            (-3 + 4 * cos2_sigma_m ** 2)))
+
+    meters = MINOR * A * (sigma - delta_sigma) * 1000
+    meters[sin_sigma == 0] = 0
+    return meters
+
+def _coordinates(locations):
+    return np.array([[loc[0], loc[1]] for loc in locations], dtype=np.float64).reshape(-1, 2)
+
+def vincenty_triangle(locations, cache=None):
+    """Returns the Vincenty distances in meters of the upper triangle only.
+
+    Entry k holds d(i, j) for the k-th pair of np.triu_indices(N, 1). The
+    ellipsoidal distance is symmetric, so this is half the work of the full
+    N x N matrix. With a cache, only the pairs it misses are computed.
+    """
+    rows, cols = np.triu_indices(len(locations), 1)
+    return vincenty_arcs(locations, rows, cols, cache)
+
+def vincenty_arcs(locations, rows, cols, cache=None):
+    """Returns the Vincenty distances in meters of the arcs rows[k] -> cols[k].
+
+    With a cache, only the arcs it misses are computed.
+    """
+    coords = _coordinates(locations)
+    if cache is None:
+        return vincenty_pairs(coords[rows, 0], coords[rows, 1], coords[cols, 0], coords[cols, 1])
+
+    keys = matrix_cache.pair_keys(locations, rows, cols, "VINCENTY")
+    found, cached = cache.lookup(keys)
+    distances = cached.astype(np.float64)
+    missing = ~found
+    rows, cols = rows[missing], cols[missing]
+    distances[missing] = vincenty_pairs(coords[rows, 0], coords[rows, 1], coords[cols, 0], coords[cols, 1])
+    cache.store(keys[missing], distances[missing])
+    return distances
+
+def vincenty_blocks(location_sets, cache=None):
+    """Returns the N x N Vincenty distances of each set of locations.
+
+    The upper triangles of all the sets go through one vincenty_arcs call,
+    so many small matrices cost one vectorized pass.
+    """
+    sizes = [len(locations) for locations in location_sets]
+    offsets = np.cumsum([0] + sizes)
+    triangles = [np.triu_indices(size, 1) for size in sizes]
+    empty = [np.zeros(0, dtype=np.int64)]
+    rows = np.concatenate(empty + [triangle[0] + offset for triangle, offset in zip(triangles, offsets)])
+    cols = np.concatenate(empty + [triangle[1] + offset for triangle, offset in zip(triangles, offsets)])
+    everything = [location for locations in location_sets for location in locations]
+    distances = vincenty_arcs(everything, rows, cols, cache) if len(rows) else np.zeros(0)
+
+    blocks = []
+    start = 0
+    for size, (block_rows, block_cols) in zip(sizes, triangles):
+        values = np.zeros((size, size))
+        values[block_rows, block_cols] = distances[start:start + len(block_rows)]
+        values[block_cols, block_rows] = values[block_rows, block_cols]
+        start += len(block_rows)
+        blocks.append(values)
+    return blocks
+
+def osrm_distances(locations, fetch, cache=None):
+    """Returns the N x N OSRM distances in meters.
+
+    fetch(sources, destinations) returns the OSRM table between the given
+    indices (all of them when None). With a cache, only the rows or columns
+    that have a missing pair are fetched.
+    """
+    size = len(locations)
+    if cache is None:
+        return np.array(fetch(None, None), dtype=np.float64).reshape(size, size)
+
+    rows, cols = np.indices((size, size)).reshape(2, -1)
+    keys = matrix_cache.pair_keys(locations, rows, cols, "OSRM")
+    found, cached = cache.lookup(keys)
+    distances = cached.astype(np.float64).reshape(size, size)
+    missing = ~found.reshape(size, size)
+    # the diagonal is always 0 and never needs a request
+    np.fill_diagonal(missing, False)
+    np.fill_diagonal(distances, 0)
+    stored = missing.copy()
+
+    if missing.sum(axis=1).max() == size - 1:
+        # nothing cached at all for these sources, e.g. new stops
+        sources = np.flatnonzero(missing.sum(axis=1) == size - 1)
+        if len(sources) == size:
+            distances = np.array(fetch(None, None), dtype=np.float64).reshape(size, size)
+        else:
+            distances[sources] = np.array(fetch(sources.tolist(), None), dtype=np.float64).reshape(-1, size)
+        missing[sources] = False
+    if missing.any():
+        # what is left is patched by whichever of rows or columns is shorter
+        sources = np.flatnonzero(missing.any(axis=1))
+        destinations = np.flatnonzero(missing.any(axis=0))
+        if len(sources) <= len(destinations):
+            distances[sources] = np.array(fetch(sources.tolist(), None), dtype=np.float64).reshape(-1, size)
+        else:
+            distances[:, destinations] = np.array(fetch(None, destinations.tolist()), dtype=np.float64).reshape(size, -1)
+    if stored.any():
+        cache.store(keys[stored.reshape(-1)], distances[stored])
+    return distances
+
+def vincenty_from(origin, locations):
+    """Returns the Vincenty distances in meters from origin to every location."""
+    coords = _coordinates(locations)
+    return vincenty_pairs(origin[0], origin[1], coords[:, 0], coords[:, 1])
+
+##################
+# Matrix Storage #
+##################
+def _meters(values):
+    """Rounds distances to whole meters in a new int32 array"""
+    values = np.asarray(values, dtype=np.float64)
+    meters = np.full(values.shape, UNREACHABLE, dtype=np.int32)
+    finite = np.isfinite(values)
+    meters[finite] = np.rint(values[finite])
+    return meters
+
+class DistanceMatrix(object):
+    """Dense N x N distance matrix in whole meters.
+
+    The distances are kept in one contiguous int32 block (OR-tools works in
+    integers anyway). matrix[i][j] keeps working for the printers and the
+    result extraction, and flat exposes the same block as a 1-D buffer.
+    Pairs without a route (nan) are stored as UNREACHABLE.
+
+    Nodes can be removed or inserted in O(N) without recomputing anything:
+    the matrix is a list of slots into a growable buffer, and the block is
+    only rebuilt on the next read after a change. The depot (node 0) stays
+    in place.
+    """
+    def __init__(self, values, ignore_from_depot=False, ignore_to_depot=False):
+        self._buffer = _meters(values)
+        self._ignore_from_depot = ignore_from_depot
+        self._ignore_to_depot = ignore_to_depot
+        # ignore distance from depot to others / from others back to depot
+        if ignore_from_depot:
+            self._buffer[:1, :] = 0
+        if ignore_to_depot:
+            self._buffer[:, :1] = 0
+        self._slots = list(range(len(self._buffer)))
+        self._filled = len(self._slots)
+        self._set_values(self._buffer)
+
+    @classmethod
+    def from_locations(cls, locations, ignore_from_depot=False, ignore_to_depot=False, cache=None):
+        """Builds the Vincenty matrix from its upper triangle"""
+        size = len(locations)
+        values = np.zeros((size, size))
+        rows, cols = np.triu_indices(size, 1)
+        triangle = vincenty_triangle(locations, cache)
+        values[rows, cols] = triangle
+        values[cols, rows] = triangle
+        return cls(values, ignore_from_depot, ignore_to_depot)
+
+    @classmethod
+    def from_rows(cls, rows, ignore_from_depot=False, ignore_to_depot=False):
+        """Builds the matrix from a list of rows, e.g. an OSRM table"""
+        return cls(np.asarray(rows, dtype=np.float64), ignore_from_depot, ignore_to_depot)
+
+    def _set_values(self, values):
+        self._values = values
+        self._size = len(values)
+        # indexing a memoryview returns plain python ints, which is what the
+        # solver callbacks expect
+        self._flat = memoryview(values.reshape(-1))
+
+    def _compact(self):
+        if self._filled == len(self._buffer) and self._slots == list(range(self._filled)):
+            self._set_values(self._buffer)
+        else:
+            self._set_values(self._buffer[np.ix_(self._slots, self._slots)])
+
+    def remove(self, index):
+        """Removes the row and column of a node"""
+        if index == 0:
+            raise ValueError("The depot cannot be removed")
+        del self._slots[index]
+        self._values = None
+
+    def insert(self, index, row, col):
+        """Inserts a node at index.
+
+        row holds the distances from the new node and col the distances to
+        it, both indexed like the matrix after the insertion.
+        """
+        if index == 0:
+            raise ValueError("The depot cannot be replaced")
+        if self._filled == len(self._buffer):
+            capacity = max(2 * len(self._buffer), 1)
+            buffer = np.zeros((capacity, capacity), dtype=np.int32)
+            buffer[:self._filled, :self._filled] = self._buffer[:self._filled, :self._filled]
+            self._buffer = buffer
+        slot = self._filled
+        self._filled += 1
+        self._slots.insert(index, slot)
+
+        slots = np.array(self._slots)
+        self._buffer[slot, slots] = _meters(row)
+        self._buffer[slots, slot] = _meters(col)
+        self._buffer[slot, slot] = 0
+        if self._ignore_from_depot:
+            self._buffer[slots[0], slot] = 0
+        if self._ignore_to_depot:
+            self._buffer[slot, slots[0]] = 0
+        self._values = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __getitem__(self, from_node):
+        if self._values is None:
+            self._compact()
+        return self._flat[from_node * self._size:(from_node + 1) * self._size]
+
+    def get(self, from_node, to_node):
+        """Gets the distance of the arc from_node -> to_node"""
+        if self._values is None:
+            self._compact()
+        return self._flat[from_node * self._size + to_node]
+
+    @property
+    def values(self):
+        """Gets the N x N int32 array"""
+        if self._values is None:
+            self._compact()
+        return self._values
+
+    @property
+    def flat(self):
+        """Gets the matrix as a flat row-major buffer"""
+        if self._values is None:
+            self._compact()
+        return self._flat
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
@@ -0,0 +1,44 @@
+"""Defers the heavy imports of the handlers to their first use"""
+import sys
+import importlib.util
+
+##################
+# Lazy Importing #
+##################
+# A Lambda cold start imports every module of a handler before it answers,
+# so numpy is bound at import time but only executed on its first attribute
+# access (importlib's LazyLoader), and OR-tools is imported inside the
+# functions that build a model. The vendored google and google.protobuf
+# packages declare themselves with pkg_resources.declare_namespace, and
+# importing pkg_resources scans every installed distribution: they are
+# imported here with pkg_resources hidden, which makes them fall back to
+# pkgutil.extend_path, so the vendored files stay as they were shipped.
+
+def module(name):
+    """Returns the module `name`, executed on its first attribute access"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    lazy = importlib.util.module_from_spec(spec)
+    sys.modules[name] = lazy
+    loader.exec_module(lazy)
+    return lazy
+
+def google_namespaces():
+    """Imports the vendored google namespace packages without pkg_resources"""
+    if "google.protobuf.pyext" in sys.modules:
+        return
+    hidden = sys.modules.get("pkg_resources")
+    # a None entry makes `import pkg_resources` raise ImportError
+    sys.modules["pkg_resources"] = None
+    try:
+        importlib.import_module("google.protobuf.pyext")
+    finally:
+        if hidden is None:
+            del sys.modules["pkg_resources"]
+        else:
+            sys.modules["pkg_resources"] = hidden
+
+google_namespaces()
@@ -0,0 +1,83 @@
+"""Times the barrier crossing mask against testing every arc and segment
+
+Draws a winding river with a few branches across the stops of the VRP
+fixture (repeated with jitter up to the given sizes), then builds the
+crossing mask with barriers.crossing_arcs and with a brute force test of
+every arc against every segment, checks that both agree and reports the
+time of each.
+
+    python bench_barriers.py --size 300 1000 --segments 2000
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import barriers
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vrp_300.json")
+
+def make_locations(size, seed=0):
+    with open(FIXTURE) as f:
+        points = [point[:2] for point in json.load(f)["points"]]
+    rng = np.random.RandomState(seed)
+    extra = [[point[0] + rng.normal(0, 0.003), point[1] + rng.normal(0, 0.003)]
+             for point in (points[1:] * (size // len(points) + 1))[:max(0, size - len(points))]]
+    return (points + extra)[:size]
+
+def make_river(locations, segments, branches=4, seed=0):
+    """A GeoJSON MultiLineString winding across the bounding box of locations"""
+    coords = np.array(locations)
+    (south, west), (north, east) = coords.min(axis=0), coords.max(axis=0)
+    rng = np.random.RandomState(seed)
+    lines = []
+    per_line = max(1, segments // branches)
+    for branch in range(branches):
+        lng = np.linspace(west, east, per_line + 1)
+        phase = rng.rand() * 2 * np.pi
+        lat = south + (north - south) * (branch + 0.5) / branches \
+            + (north - south) * 0.1 * np.sin(np.linspace(0, 6 * np.pi, per_line + 1) + phase)
+        lines.append(np.column_stack((lng, lat)).tolist())
+    return {"type": "Feature", "geometry": {"type": "MultiLineString", "coordinates": lines}}
+
+def brute_force(locations, chunks):
+    points = np.array([[loc[1], loc[0]] for loc in locations])
+    segments = np.vstack([chunk[2] for chunk in chunks])
+    rows, cols = np.triu_indices(len(points), 1)
+    crosses = np.zeros((len(points), len(points)), dtype=bool)
+    for start in range(0, len(rows), 4096):
+        batch = slice(start, start + 4096)
+        crosses[rows[batch], cols[batch]] = barriers._cross(points[rows[batch]], points[cols[batch]], segments)
+    return crosses | crosses.T
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs="+", default=[300, 1000])
+    parser.add_argument("--segments", type=int, default=2000)
+    parser.add_argument("--skip-brute-force", action="store_true")
+    args = parser.parse_args()
+
+    print("{0:>6} {1:>9} {2:>10} {3:>12} {4:>9}".format("stops", "segments", "index s", "brute s", "crossing"))
+    for size in args.size:
+        locations = make_locations(size)
+        chunks = barriers.chunk_segments(make_river(locations, args.segments))
+        start = time.time()
+        crosses = barriers.crossing_arcs(locations, chunks)
+        indexed = time.time() - start
+        brute = float("nan")
+        if not args.skip_brute_force:
+            start = time.time()
+            expected = brute_force(locations, chunks)
+            brute = time.time() - start
+            assert (crosses == expected).all(), "the indexed mask differs from the brute force one"
+        print("{0:>6} {1:>9} {2:10.3f} {3:12.3f} {4:8.1f}%".format(
+            size, sum(len(chunk[2]) for chunk in chunks), indexed, brute, crosses.mean() * 100))
+
+if __name__ == '__main__':
+    main()
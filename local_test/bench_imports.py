@@ -0,0 +1,212 @@
+"""Import-time profile and cold start of the handler modules
+
+For each entry module, a fresh interpreter imports it under -X importtime;
+the report keeps its total import time, the self time of each top-level
+package and the slowest modules. A second fresh interpreter imports the
+module and answers one fixture event, which is the Lambda cold start: the
+wall time of the whole process, the import and the first request, and
+which of the heavy modules (protobuf, the ortools SWIG module, OSRM
+client...) each of them loaded. Reports are compared like benchmark.py's.
+
+    python bench_imports.py --output before.json --repeat 5
+    python bench_imports.py --compare before.json after.json
+"""
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import collections
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# entry module, its handler and the fixture of its cold start
+ENTRIES = [
+    ("vrp", "handle", "vrp_20"),
+    ("pdvrp", "handle", "pdvrp_20"),
+    ("pdvrp_cod", "handle", "pdvrp_cod_20"),
+    ("tsp", "tsp", "tsp_10"),
+    ("server", None, None),
+]
+# modules whose presence in sys.modules the cold start reports
+HEAVY = [
+    # numpy itself is in sys.modules from the import on, executed or not
+    "numpy.linalg",
+    "pkg_resources",
+    "google.protobuf",
+    "ortools.constraint_solver.pywrapcp",
+    "ortools.constraint_solver.routing_enums_pb2",
+    "ortools.constraint_solver.routing_parameters_pb2",
+    "geopy",
+    "six",
+    "osrm_client",
+    "concurrent.futures",
+    "multiprocessing",
+]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+COLD_START = """
+import sys, time, json, io, contextlib
+start = time.time()
+import {module}
+imported = time.time()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+response = None
+if {entry!r}:
+    with open({fixture!r}) as f:
+        body = f.read()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = getattr({module}, {entry!r})({{"body": body}}, None)
+done = time.time()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "request_ms": (done - imported) * 1000,
+    "status": response["statusCode"] if response else None,
+    "import_loads": loaded,
+    "request_loads": [name for name in {heavy!r} if name in sys.modules and name not in loaded],
+}}))
+"""
+
+###########
+# Profile #
+###########
+def import_profile(module):
+    """Total import ms of the module, self ms per top-level package and the
+    slowest modules by cumulative time"""
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import " + module],
+                               cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+    if process.returncode:
+        raise RuntimeError(errors.decode("utf-8").strip().splitlines()[-1])
+    packages = collections.defaultdict(float)
+    modules = []
+    total = None
+    for line in errors.decode("utf-8").splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = match.groups()
+        packages[name.split(".")[0]] += int(own) / 1000.
+        modules.append((int(cumulative) / 1000., name))
+        if name == module:
+            total = int(cumulative) / 1000.
+    return total, dict(packages), [[name, ms] for ms, name in sorted(modules, reverse=True)[:15]]
+
+def cold_start(module, entry, fixture):
+    """Wall ms of a fresh process importing the module and answering one event"""
+    code = COLD_START.format(module=module, entry=entry, heavy=HEAVY,
+                             fixture=os.path.join(FIXTURES, fixture + ".json") if fixture else None)
+    start = time.time()
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT)
+    run = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    run["process_ms"] = (time.time() - start) * 1000
+    return run
+
+###########
+# Harness #
+###########
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(args):
+    entries = []
+    for module, entry, fixture in ENTRIES:
+        if args.filter and not re.search(args.filter, module):
+            continue
+        profiles = [import_profile(module) for _ in range(args.repeat)]
+        runs = [cold_start(module, entry, fixture) for _ in range(args.repeat)]
+        result = {
+            "module": module,
+            "import_ms": median([profile[0] for profile in profiles]),
+            "packages": dict((name, median([profile[1].get(name, 0) for profile in profiles]))
+                             for name in profiles[-1][1]),
+            "slowest": profiles[-1][2],
+            "process_ms": median([run["process_ms"] for run in runs]),
+            "cold_import_ms": median([run["import_ms"] for run in runs]),
+            "first_request_ms": median([run["request_ms"] for run in runs]),
+            "status": runs[-1]["status"],
+            "import_loads": runs[-1]["import_loads"],
+            "request_loads": runs[-1]["request_loads"],
+        }
+        entries.append(result)
+        top = sorted(result["packages"].items(), key=lambda item: -item[1])[:5]
+        print("{0:<10} import {1:7.1f} ms  process {2:7.1f} ms  first request {3:7.1f} ms  {4}".format(
+            module, result["import_ms"], result["process_ms"], result["first_request_ms"],
+            " ".join("{0} {1:.1f}".format(name, ms) for name, ms in top)))
+        print("{0:<10} on import: {1}".format("", ", ".join(result["import_loads"]) or "-"))
+        print("{0:<10} on request: {1}".format("", ", ".join(result["request_loads"]) or "-"))
+
+    report = {
+        "revision": revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "entries": entries,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("Report written to " + args.output)
+
+def change(before, after):
+    if not before:
+        return "n/a"
+    return "{0:+.1f}%".format((after - before) * 100. / before)
+
+def compare(args):
+    """Prints the change of each entry module, True when no import got slower
+    than the threshold"""
+    with open(args.compare[0]) as f:
+        before = json.load(f)
+    with open(args.compare[1]) as f:
+        after = json.load(f)
+    old_entries = dict((entry["module"], entry) for entry in before["entries"])
+    print("{0} -> {1}".format(before.get("revision"), after.get("revision")))
+    print("{0:<10} {1:>10} {2:>9} {3:>11} {4:>9} {5:>14} {6:>9}".format(
+        "module", "import ms", "change", "process ms", "change", "first request", "change"))
+    regressions = []
+    for entry in after["entries"]:
+        old = old_entries.get(entry["module"])
+        if old is None:
+            print("{0:<10} {1:10.1f} {2:>9}".format(entry["module"], entry["import_ms"], "new"))
+            continue
+        print("{0:<10} {1:10.1f} {2:>9} {3:11.1f} {4:>9} {5:14.1f} {6:>9}".format(
+            entry["module"], entry["import_ms"], change(old["import_ms"], entry["import_ms"]),
+            entry["process_ms"], change(old["process_ms"], entry["process_ms"]),
+            entry["first_request_ms"], change(old["first_request_ms"], entry["first_request_ms"])))
+        if entry["import_ms"] > old["import_ms"] * (1 + args.threshold) and entry["import_ms"] - old["import_ms"] > 5:
+            regressions.append(entry["module"])
+    if regressions:
+        print("Import slower by more than {0:.0%}: {1}".format(args.threshold, ", ".join(regressions)))
+    return not regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="JSON report to write")
+    parser.add_argument("--filter", help="regular expression the entry modules must match")
+    parser.add_argument("--repeat", type=int, default=3, help="processes per measurement, timings are their median")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two reports")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(args) else 1)
+    # a warm distance cache would hide the cost of the first request
+    os.environ["DISTANCE_CACHE_DIR"] = ""
+    benchmark(args)
+
+if __name__ == '__main__':
+    main()
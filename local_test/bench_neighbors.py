@@ -0,0 +1,102 @@
+"""Quality versus time of the k-nearest-neighbor arc restriction
+
+Solves the same VRP request with neighbors=0 (the full matrix) and with
+each k given, and reports the time to build the distances, the total time
+of vrp.handle, and the length of the returned routes measured on the exact
+Vincenty matrix.
+
+    python bench_neighbors.py --size 1000 --neighbors 5 10 20 --time-budget-ms 20000
+"""
+from __future__ import print_function
+import os
+import io
+import sys
+import copy
+import json
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import vrp
+import vrp_constraints
+import vrp_data_problem
+import distance_matrix
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vrp_300.json")
+
+def make_event(size, seed=0):
+    """The 300 stop fixture, repeated with ~300 m of jitter up to size stops"""
+    with open(FIXTURE) as f:
+        event = json.load(f)
+    points = event["points"]
+    rng = np.random.RandomState(seed)
+    extra = [[point[0] + rng.normal(0, 0.003), point[1] + rng.normal(0, 0.003), point[2]]
+             for point in (points[1:] * (size // len(points) + 1))[:max(0, size - len(points))]]
+    event["points"] = (points + extra)[:size]
+    event["vehicle_num"] = max(event["vehicle_num"], size // 10)
+    event["max_distance"] = 0
+    return event
+
+def route_length(event, cluster):
+    """Length of the returned routes on the exact, mode-masked matrix"""
+    locations = [point[:2] for point in event["points"]]
+    matrix = distance_matrix.DistanceMatrix.from_locations(
+        locations,
+        ignore_from_depot=event["transport_mode"] == "N1",
+        ignore_to_depot=event["transport_mode"] == "1N").values
+    index = dict((tuple(location), node) for node, location in enumerate(locations))
+    total = 0
+    for route in cluster["cluster"] + cluster["violated_cluster"]:
+        nodes = [index[tuple(stop)] for stop in route]
+        if event["transport_mode"] == "1N1":
+            nodes.append(0)
+        total += sum(matrix[a, b] for a, b in zip(nodes, nodes[1:]))
+    return total
+
+def build_time(event, neighbors):
+    data = vrp_data_problem.DataProblem(
+        copy.deepcopy(event["points"]), event["vehicle_num"], event.get("min_parcels", 0),
+        event.get("max_parcels", 20), event.get("max_distance", 0), event["transport_mode"], "VINCENTY")
+    start = time.time()
+    vrp_constraints.CreateDistanceEvaluator(data, neighbors).get_arc_cost_matrix(data.num_locations > 100)
+    return time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--neighbors", type=int, nargs="+", default=[5, 10, 20, 40])
+    parser.add_argument("--time-budget-ms", type=int, default=20000)
+    args = parser.parse_args()
+
+    # the persistent cache would hide the cost of the exact distances
+    os.environ["DISTANCE_CACHE_DIR"] = ""
+    import matrix_cache
+    matrix_cache.CACHE_DIR = ""
+
+    event = make_event(args.size)
+    event["time_budget_ms"] = args.time_budget_ms
+    print("{0} stops, {1} vehicles, {2} ms budget".format(len(event["points"]), event["vehicle_num"], args.time_budget_ms))
+    print("{0:>9} {1:>10} {2:>10} {3:>14} {4:>9}".format("neighbors", "matrix s", "total s", "length m", "vs full"))
+    full = None
+    for neighbors in [0] + args.neighbors:
+        event["neighbors"] = neighbors
+        matrix_seconds = build_time(event, neighbors)
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = vrp.handle({"body": json.dumps(event)}, None)
+        seconds = time.time() - start
+        cluster = json.loads(response["body"])
+        if not isinstance(cluster, dict):
+            print("{0:>9} {1}".format(neighbors, cluster))
+            continue
+        length = route_length(event, cluster)
+        full = length if full is None else full
+        print("{0:>9} {1:10.3f} {2:10.3f} {3:14.0f} {4:+8.2f}%".format(
+            neighbors or "full", matrix_seconds, seconds, length, (length / full - 1) * 100))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Compares one-shot urllib requests with the pooled OSRM client
+
+Runs the same table requests against the local OSRM stub, once opening a
+new connection per request (the old client) and once through the
+keep-alive pool, and prints the latency of each.
+
+    python bench_osrm.py --requests 50 --size 100
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import argparse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import osrm_stub
+import osrm_client
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vrp_100.json")
+
+def one_shot(path):
+    response = urllib.request.urlopen(osrm_client.OSRM_URL + path).read().decode('UTF-8')
+    return json.loads(response)
+
+def measure(get, path, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.time()
+        get(path)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    return sum(latencies) / len(latencies), latencies[len(latencies) // 2], latencies[-1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--url", help="benchmark a real server instead of the stub")
+    args = parser.parse_args()
+
+    if args.url:
+        osrm_client.OSRM_URL = args.url
+    else:
+        server = osrm_stub.serve(max_table_size=args.size)
+        osrm_client.OSRM_URL = "http://127.0.0.1:{0}".format(server.server_address[1])
+
+    with open(FIXTURE) as f:
+        locations = [point[:2] for point in json.load(f)["points"][:args.size]]
+    path = "/table/v1/driving/"
+    path += ";".join(str(loc[1]) + "," + str(loc[0]) for loc in locations)
+    path += "?annotations=distance"
+
+    for name, get, gzip in (("urlopen", one_shot, False),
+                            ("pooled", osrm_client.get, False),
+                            ("pooled+gzip", osrm_client.get, True)):
+        osrm_client.GZIP = gzip
+        mean, median, worst = measure(get, path, args.requests)
+        print("{0:12} mean {1:7.2f} ms  median {2:7.2f} ms  max {3:7.2f} ms".format(
+            name, mean * 1000, median * 1000, worst * 1000))
+
+if __name__ == '__main__':
+    main()
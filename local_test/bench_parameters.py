@@ -0,0 +1,70 @@
+"""Per-request cost of building the routing parameters
+
+Compares what the handlers used to do on every request, calling
+DefaultSearchParameters()/DefaultModelParameters() and setting the strategy,
+with a CopyFrom of the templates search_control keeps, and reports the cost of
+serializing the search parameters, which SolveWithParameters pays either way.
+search_control logs the protobuf implementation in use (python or cpp) when
+it builds the first template.
+
+    python bench_parameters.py --requests 2000
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
+
+import routing_transits
+import search_control
+
+NUM_LOCATIONS = 100
+
+def built():
+    parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
+    parameters.time_limit_ms = 10000
+    parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC
+    routing_transits.cache_callbacks(pywrapcp.RoutingModel.DefaultModelParameters(), NUM_LOCATIONS)
+    return parameters
+
+def copied():
+    parameters = search_control.default_parameters("AUTOMATIC")
+    parameters.time_limit_ms = 10000
+    routing_transits.cache_callbacks(search_control.model_parameters(), NUM_LOCATIONS)
+    return parameters
+
+def per_request_us(function, requests, repeat):
+    """Median over repeat rounds of the microseconds per call"""
+    rounds = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(requests):
+            function()
+        rounds.append((time.time() - start) * 1e6 / requests)
+    return sorted(rounds)[len(rounds) // 2]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # builds the templates outside the timing
+    copied()
+    parameters = copied()
+    results = [
+        ("DefaultSearchParameters", per_request_us(built, args.requests, args.repeat)),
+        ("template copy", per_request_us(copied, args.requests, args.repeat)),
+        ("SerializeToString", per_request_us(parameters.SerializeToString, args.requests, args.repeat)),
+    ]
+    for name, us in results:
+        print("{0:<24} {1:9.1f} us per request".format(name, us))
+    print("template copy is x{0:.1f} faster".format(results[0][1] / results[1][1]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compares the peak memory of decoding an OSRM table response
+
+Builds a response body the way osrm-routed lays it out and decodes it once
+with json.loads + np.array (the old path) and once with
+osrm_client.parse_distances, reporting the tracemalloc peak and the time of
+each.
+
+    python bench_parse.py --size 100 300 1000
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import osrm_client
+
+def response(size):
+    """A table response of size x size distances with a few unreachable pairs"""
+    rng = np.random.RandomState(size)
+    distances = (rng.rand(size, size) * 30000).round(1).tolist()
+    for row in distances[::7]:
+        row[-1] = None
+    waypoints = [{"hint": "x" * 40, "distance": 1.5, "name": "", "location": [106.7, 10.8]}] * size
+    return json.dumps({"code": "Ok", "distances": distances,
+                       "sources": waypoints, "destinations": waypoints}).encode("utf-8")
+
+def json_decode(body):
+    return np.array(json.loads(body.decode("UTF-8"))["distances"], dtype=np.float64).reshape(-1)
+
+def streaming_decode(body):
+    return osrm_client.parse_distances(body)
+
+def measure(decode, body):
+    """The result, the tracemalloc peak and the time of an untraced run;
+    tracing every allocation would slow the parsers down unevenly"""
+    start = time.time()
+    distances = decode(body)
+    elapsed = time.time() - start
+    tracemalloc.start()
+    decode(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return distances, peak, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, nargs="+", default=[100, 300, 1000])
+    args = parser.parse_args()
+
+    for size in args.size:
+        body = response(size)
+        print("{0} x {0} table, {1:.1f} MB body".format(size, len(body) / 1e6))
+        results = []
+        for name, decode in (("json.loads", json_decode), ("streaming", streaming_decode)):
+            distances, peak, elapsed = measure(decode, body)
+            results.append(distances)
+            print("  {0:11} peak {1:8.2f} MB  {2:7.1f} ms".format(name, peak / 1e6, elapsed * 1000))
+        assert np.array_equal(results[0], results[1], equal_nan=True)
+
+if __name__ == '__main__':
+    main()
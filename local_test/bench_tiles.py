@@ -0,0 +1,55 @@
+"""Measures tiled OSRM table fetching against a delayed stub
+
+Every stub response is held back by --delay seconds, so the wall time of a
+table should follow ceil(tiles / concurrency) * delay rather than the raw
+number of tiles.
+
+    python bench_tiles.py --size 300 --delay 0.1 --concurrency 1 4 8 16
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import osrm_stub
+import osrm_client
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vrp_300.json")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=300)
+    parser.add_argument("--delay", type=float, default=0.1)
+    parser.add_argument("--max-table-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    server = osrm_stub.serve(delay=args.delay, max_table_size=args.max_table_size)
+    osrm_client.OSRM_URL = "http://127.0.0.1:{0}".format(server.server_address[1])
+    osrm_client.MAX_TABLE_SIZE = args.max_table_size
+    # keep one idle connection per worker of the largest run
+    osrm_client.CONCURRENCY = max(args.concurrency)
+
+    with open(FIXTURE) as f:
+        points = json.load(f)["points"]
+    locations = [point[:2] for point in (points * (args.size // len(points) + 1))[:args.size]]
+    block = args.max_table_size // 2
+    tiles = int(math.ceil(float(args.size) / block)) ** 2
+
+    print("{0} locations, {1} tiles, {2:.0f} ms per response".format(args.size, tiles, args.delay * 1000))
+    for concurrency in args.concurrency:
+        start = time.time()
+        osrm_client.table(locations, concurrency=concurrency)
+        elapsed = time.time() - start
+        expected = int(math.ceil(float(tiles) / concurrency)) * args.delay
+        print("concurrency {0:3}: {1:7.3f} s  (ceil(tiles / concurrency) * delay = {2:.3f} s)".format(
+            concurrency, elapsed, expected))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Compares python arc callbacks with the native matrix/vector transits
+
+Both models are solved with the same time limit on a local_test fixture and
+the number of solutions and search branches explored are reported. The
+native model is built by routing_transits.routing_model, with the callback
+cache sized to the node count.
+
+    python bench_transits.py fixtures/vrp_300.json 25000
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
+
+import vrp_data_problem as data_problem
+import vrp_constraints
+import routing_transits
+
+def build_callback_model(data, matrix):
+    """Model as it was built before routing_transits: every arc is a python call"""
+    routing = pywrapcp.RoutingModel(data.num_locations, data.num_vehicles, data.depot)
+
+    def distance_evaluator(from_node, to_node):
+        return matrix[from_node][to_node]
+
+    def parcels_evaluator(from_node, to_node):
+        return data.parcels[from_node]
+
+    routing.SetArcCostEvaluatorOfAllVehicles(distance_evaluator)
+    if data.maximum_distance != 0:
+        routing.AddDimension(distance_evaluator, 0, data.maximum_distance, True, "Distance")
+    routing.AddDimension(parcels_evaluator, 0, data.max_parcels, True, "Parcels")
+    routing.python_callbacks = [distance_evaluator, parcels_evaluator]
+    return routing
+
+def build_native_model(data, matrix):
+    routing = routing_transits.routing_model(data.num_locations, data.num_vehicles, data.depot)
+    routing_transits.set_arc_costs(routing, matrix)
+    if data.maximum_distance != 0:
+        vrp_constraints.add_distance_dimension(routing, data, matrix)
+    vrp_constraints.add_parcels_constraints(routing, data)
+    return routing
+
+def solve(routing, time_limit_ms):
+    solutions = []
+    routing.AddAtSolutionCallback(lambda: solutions.append(time.time()))
+    search_parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
+    search_parameters.time_limit_ms = time_limit_ms
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_MOST_CONSTRAINED_ARC)
+
+    start_time = time.time()
+    assignment = routing.SolveWithParameters(search_parameters)
+    return {
+        "seconds": time.time() - start_time,
+        "objective": assignment.ObjectiveValue() if assignment else None,
+        "solutions": len(solutions),
+        "branches": routing.solver().Branches(),
+        "failures": routing.solver().Failures(),
+    }
+
+def main():
+    fixture = sys.argv[1] if len(sys.argv) > 1 else "fixtures/vrp_300.json"
+    time_limit_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 25000
+    event = json.load(open(fixture))
+
+    results = {}
+    for name, build in (("callback", build_callback_model), ("native", build_native_model)):
+        data = data_problem.DataProblem(
+            [loc[:] for loc in event["points"]], event["vehicle_num"], event.get("min_parcels", 0),
+            event.get("max_parcels", 20), event.get("max_distance", 0), event["transport_mode"], "VINCENTY")
+        matrix = vrp_constraints.CreateDistanceEvaluator(data).get_distance_matrix()
+        routing = build(data, matrix)
+        results[name] = solve(routing, time_limit_ms)
+        print(name, results[name])
+
+    if results["callback"]["branches"]:
+        print("branches explored: x{0:.2f}".format(
+            results["native"]["branches"] / float(results["callback"]["branches"])))
+
+if __name__ == '__main__':
+    main()
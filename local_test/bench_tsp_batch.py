@@ -0,0 +1,68 @@
+"""Compares one tsp_batch call against a tsp.tsp call per route
+
+Cuts the stops of the VRP fixture into routes of a few stops each (what the
+clustering hands to the TSP), then solves them once route by route and once
+as a batch, and reports the wall time of each.
+
+    python bench_tsp_batch.py --routes 200 --stops 8 --workers 4
+"""
+from __future__ import print_function
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tsp
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "vrp_300.json")
+
+def make_routes(count, stops, seed=0):
+    with open(FIXTURE) as f:
+        points = [point[:2] for point in json.load(f)["points"]]
+    rng = np.random.RandomState(seed)
+    return [{"points": [points[0]] + [points[index] for index in rng.choice(np.arange(1, len(points)), stops - 1, False)]}
+            for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, default=200)
+    parser.add_argument("--stops", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--time-budget-ms", type=int, default=1000)
+    args = parser.parse_args()
+
+    # the persistent cache would hide the cost of the matrices
+    import matrix_cache
+    matrix_cache.CACHE_DIR = ""
+
+    routes = make_routes(args.routes, args.stops)
+    for route in routes:
+        route["time_budget_ms"] = args.time_budget_ms
+
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        single = [tsp.tsp({"body": json.dumps(dict(route, transport_mode="1N1"))}, None) for route in routes]
+    single_seconds = time.time() - start
+
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        batch = tsp.tsp_batch({"body": json.dumps({"routes": routes, "workers": args.workers, "timings": True})}, None)
+    batch_seconds = time.time() - start
+    body = json.loads(batch["body"])
+
+    same = sum(1 for one, result in zip(single, body["routes"])
+               if one and json.loads(one["body"])["route"] == result.get("route"))
+    print("{0} routes of {1} stops, {2} workers".format(args.routes, args.stops, args.workers))
+    print("one call per route: {0:8.3f} s".format(single_seconds))
+    print("tsp_batch:          {0:8.3f} s  {1}".format(batch_seconds, body["timings"]["phases"]))
+    print("same route as the single call: {0} of {1}".format(same, args.routes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compares the small-route TSP path against OR-tools
+
+Solves random routes of the VRP fixture's stops of each size with
+tsp_heuristics (Held-Karp or 2-opt/Or-opt) and with the routing model, and
+reports the median solve time of each and how much longer the heuristic
+tours are.
+
+    python bench_tsp_small.py --sizes 5 8 12 20 40 --routes 20
+"""
+from __future__ import print_function
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tsp
+import tsp_heuristics
+from bench_tsp_batch import make_routes
+
+def solve(points, transport_mode, fast_path_max_nodes, time_budget_ms):
+    tsp_heuristics.FAST_PATH_MAX_NODES = fast_path_max_nodes
+    dist_matrix = tsp.create_distance_matrix(points, transport_mode, "VINCENTY")
+    start = time.time()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        tsp.solve_route(points, dist_matrix, transport_mode, time_budget_ms)
+    seconds = time.time() - start
+    cost = int(next(line for line in output.getvalue().splitlines() if line.startswith("Total distance: ")).split()[-1])
+    return seconds, cost
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 8, 12, 20, 40])
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--transport-mode", default="1N1")
+    parser.add_argument("--time-budget-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    import matrix_cache
+    matrix_cache.CACHE_DIR = ""
+
+    print("{0:>5} {1:>12} {2:>12} {3:>10} {4:>10}".format("size", "fast ms", "ortools ms", "mean gap", "max gap"))
+    for size in args.sizes:
+        fast, ortools, gaps = [], [], []
+        for route in make_routes(args.routes, size, seed=size):
+            fast_seconds, fast_cost = solve(route["points"], args.transport_mode, size, args.time_budget_ms)
+            ortools_seconds, ortools_cost = solve(route["points"], args.transport_mode, 0, args.time_budget_ms)
+            fast.append(fast_seconds * 1000)
+            ortools.append(ortools_seconds * 1000)
+            gaps.append(float(fast_cost) / ortools_cost - 1 if ortools_cost else 0.)
+        print("{0:>5} {1:12.2f} {2:12.2f} {3:9.2f}% {4:9.2f}%".format(
+            size, np.median(fast), np.median(ortools), 100 * np.mean(gaps), 100 * np.max(gaps)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""Benchmarks the handlers over the fixtures and compares reports
+
+Every fixtures/<handler>_<size>.json is an event body of vrp.handle,
+pdvrp.handle, pdvrp_cod.handle or tsp.tsp. Each case runs in a fresh
+process so that its peak RSS and cold caches are its own, and records the
+time of each phase, the objective of the returned solution, the number
+of routes and ru_maxrss (kilobytes on Linux). The phases come from the
+"timings" the handler returns, and are measured from outside on revisions
+that have none (phases_from says which). The handler's own, finer phases
+are kept as they are in handler_timings. The runs go to a JSON report; two
+reports are compared case by case with --compare.
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --filter '^vrp_' --repeat 3
+    python benchmark.py --compare before.json after.json
+"""
+from __future__ import print_function
+import os
+import io
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import contextlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# module and entry point of each handler, longest prefix first
+HANDLERS = [
+    ("pdvrp_cod", "pdvrp_cod", "handle"),
+    ("pdvrp", "pdvrp", "handle"),
+    ("vrp", "vrp", "handle"),
+    ("tsp", "tsp", "tsp"),
+]
+PHASES = ["parse", "matrix", "model", "solve", "extraction"]
+
+##############
+# Inside Run #
+##############
+# The case asks for the handler's "timings": the phases it reports are added
+# up into the five above (the VRP's hard and soft models, feasibility check,
+# warm start and sectors into the model or the solve, its distance filter
+# into the parse and the printing into the extraction) and its objective is
+# the one of the returned solution. Handlers that return no timings only
+# print their total time, so the child process also wraps the functions
+# that bound each phase and keeps a timeline: the matrix is the distance
+# evaluator, the model everything from there to the first solve, the solve
+# every (portfolio) solve and the extraction everything after the last one.
+PHASE_OF = {
+    "filter": "parse",
+    "feasibility": "model",
+    "model_hard": "model",
+    "model_soft": "model",
+    "warm_start": "model",
+    "decomposition": "solve",
+    "solve_hard": "solve",
+    "solve_soft": "solve",
+    "printing": "extraction",
+}
+
+def phases_of(handler_timings):
+    """Seconds of each of PHASES in the handler's timings"""
+    phases = dict((phase, 0.0) for phase in PHASES)
+    for name, ms in handler_timings["phases"].items():
+        phases[PHASE_OF.get(name, name)] += ms / 1000.
+    return phases
+
+class Timeline(object):
+    def __init__(self):
+        self.intervals = {"matrix": [], "solve": []}
+        self.objective = None
+        self._depth = 0
+
+    def wrap(self, owner, name, phase):
+        function = getattr(owner, name)
+        timeline = self
+
+        def timed(*args, **kwargs):
+            # only the outermost of nested solve calls counts
+            timeline._depth += 1
+            start = time.time()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                timeline._depth -= 1
+            if timeline._depth == 0:
+                timeline.intervals[phase].append((start, time.time()))
+            timeline.record(result)
+            return result
+        setattr(owner, name, timed)
+
+    def record(self, result):
+        """Keeps the objective of an assignment or a (objective, routes, ...) tuple"""
+        if hasattr(result, "ObjectiveValue"):
+            self.objective = result.ObjectiveValue()
+        elif isinstance(result, tuple) and len(result) == 3 and isinstance(result[0], (int, float)):
+            self.objective = result[0]
+
+    def phases(self, start, end):
+        matrix = self.intervals["matrix"]
+        solve = self.intervals["solve"]
+        phases = dict((phase, 0.0) for phase in PHASES)
+        if not matrix:
+            phases["parse"] = end - start
+            return phases
+        phases["parse"] = matrix[0][0] - start
+        phases["matrix"] = sum(stop - begin for begin, stop in matrix)
+        if solve:
+            phases["model"] = solve[0][0] - matrix[-1][1]
+            phases["solve"] = sum(stop - begin for begin, stop in solve)
+            phases["extraction"] = end - solve[-1][1]
+        else:
+            phases["extraction"] = end - matrix[-1][1]
+        return phases
+
+def routes_of(body):
+    if isinstance(body, dict) and "cluster" in body:
+        return len(body["cluster"]) + len(body.get("violated_cluster", []))
+    if isinstance(body, dict) and "route" in body:
+        return 1
+    return 0
+
+def run_case(path):
+    """Runs one fixture in this process and returns its measurements"""
+    sys.path.insert(0, ROOT)
+    name = os.path.splitext(os.path.basename(path))[0]
+    prefix, module_name, entry = next(handler for handler in HANDLERS if name.startswith(handler[0] + "_"))
+    with open(path) as f:
+        event = json.load(f)
+    event["timings"] = True
+    body = json.dumps(event)
+
+    import importlib
+    started = time.time()
+    module = importlib.import_module(module_name)
+    import_seconds = time.time() - started
+    import search_control
+    import solver_portfolio
+    constraints = {"vrp": "vrp_constraints", "pdvrp": "pdvrp_constraints", "pdvrp_cod": "pdvrp_cod_constraints"}
+
+    timeline = Timeline()
+    if module_name == "tsp":
+        timeline.wrap(module, "create_distance_matrix", "matrix")
+    else:
+        timeline.wrap(importlib.import_module(constraints[module_name]).CreateDistanceEvaluator, "__init__", "matrix")
+    timeline.wrap(search_control, "solve", "solve")
+    timeline.wrap(solver_portfolio.PendingSolve, "best", "solve")
+    timeline.wrap(solver_portfolio.PendingSolve, "result", "solve")
+
+    log = io.StringIO()
+    start = time.time()
+    with contextlib.redirect_stdout(log):
+        response = getattr(module, entry)({"body": body}, None)
+    end = time.time()
+
+    status = response["statusCode"] if response else None
+    result = json.loads(response["body"]) if response else None
+    handler_timings = result.pop("timings", None) if isinstance(result, dict) else None
+    if handler_timings is not None:
+        phases, phases_from = phases_of(handler_timings), "handler"
+        objective = handler_timings.get("objective", timeline.objective)
+    else:
+        phases, phases_from = timeline.phases(start, end), "external"
+        objective = timeline.objective
+    return {
+        "case": name,
+        "handler": prefix,
+        "size": int(name[len(prefix) + 1:]) if name[len(prefix) + 1:].isdigit() else None,
+        "status": status,
+        # with timings a string body comes back as {"title": ...}
+        "solved": isinstance(result, dict) and "title" not in result,
+        "seconds": end - start,
+        "import_seconds": import_seconds,
+        "phases": phases,
+        "phases_from": phases_from,
+        "handler_timings": handler_timings,
+        "objective": objective,
+        "vehicles": routes_of(result),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+###########
+# Harness #
+###########
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.
+
+def spawn(path, timeout):
+    """Runs one case in a fresh interpreter, None when it crashed or timed out"""
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", path]
+    try:
+        output = subprocess.check_output(command, timeout=timeout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        print("  " + os.path.basename(path) + " failed: " + str(e))
+        return None
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+def summarize(runs):
+    """One entry per case: the median of each timing over its runs"""
+    summary = dict(runs[-1])
+    summary["runs"] = len(runs)
+    summary["seconds"] = median([run["seconds"] for run in runs])
+    summary["import_seconds"] = median([run["import_seconds"] for run in runs])
+    summary["phases"] = dict((phase, median([run["phases"][phase] for run in runs])) for phase in PHASES)
+    summary["max_rss_kb"] = max(run["max_rss_kb"] for run in runs)
+    return summary
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def case_order(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    handler, size = re.match(r"(.*?)_?(\d*)$", name).groups()
+    return handler, int(size) if size else 0
+
+def benchmark(args):
+    paths = sorted(glob.glob(os.path.join(FIXTURES, "*.json")), key=case_order)
+    paths = [path for path in paths if any(os.path.basename(path).startswith(handler[0] + "_")
+                                           for handler in HANDLERS)]
+    if args.filter:
+        paths = [path for path in paths if re.search(args.filter, os.path.splitext(os.path.basename(path))[0])]
+
+    cases = []
+    for path in paths:
+        runs = [run for run in (spawn(path, args.timeout) for _ in range(args.repeat)) if run is not None]
+        if not runs:
+            continue
+        case = summarize(runs)
+        cases.append(case)
+        print("{0:<16} {1:>4} {2:8.3f}s  {3} ({4})  objective {5}  vehicles {6}  rss {7} MB".format(
+            case["case"], case["status"], case["seconds"],
+            " ".join("{0} {1:.3f}".format(phase, case["phases"][phase]) for phase in PHASES),
+            case["phases_from"], case["objective"], case["vehicles"], case["max_rss_kb"] // 1024))
+
+    report = {
+        "revision": revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("Report written to " + args.output)
+
+def change(before, after):
+    if before is None or after is None:
+        return "n/a"
+    if before == 0:
+        return "{0:+.3f}".format(after - before)
+    return "{0:+.1f}%".format((after - before) * 100. / before)
+
+def compare(args):
+    """Prints the change of each case, True when none got slower than the threshold"""
+    with open(args.compare[0]) as f:
+        before = json.load(f)
+    with open(args.compare[1]) as f:
+        after = json.load(f)
+    old_cases = dict((case["case"], case) for case in before["cases"])
+    print("{0} -> {1}".format(before.get("revision"), after.get("revision")))
+    print("{0:<16} {1:>10} {2:>10} {3:>9} {4:>9} {5:>11} {6:>9}".format(
+        "case", "seconds", "change", "solve", "matrix", "objective", "rss"))
+    regressions = []
+    for case in after["cases"]:
+        old = old_cases.get(case["case"])
+        if old is None:
+            print("{0:<16} {1:10.3f} {2:>10}".format(case["case"], case["seconds"], "new"))
+            continue
+        print("{0:<16} {1:10.3f} {2:>10} {3:>9} {4:>9} {5:>11} {6:>9}".format(
+            case["case"], case["seconds"], change(old["seconds"], case["seconds"]),
+            change(old["phases"]["solve"], case["phases"]["solve"]),
+            change(old["phases"]["matrix"], case["phases"]["matrix"]),
+            change(old["objective"], case["objective"]),
+            change(old["max_rss_kb"], case["max_rss_kb"])))
+        if old.get("phases_from", "external") != case["phases_from"]:
+            print("  phases measured from {0} before, from {1} after".format(
+                old.get("phases_from", "external"), case["phases_from"]))
+        if case["seconds"] > old["seconds"] * (1 + args.threshold) and case["seconds"] - old["seconds"] > 0.05:
+            regressions.append(case["case"])
+    if regressions:
+        print("Slower by more than {0:.0%}: {1}".format(args.threshold, ", ".join(regressions)))
+    return not regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="JSON report to write")
+    parser.add_argument("--filter", help="regular expression the fixture names must match")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, timings are their median")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a case is killed")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two reports")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression")
+    parser.add_argument("--keep-cache", action="store_true", help="use the persistent distance cache")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case)))
+    elif args.compare:
+        sys.exit(0 if compare(args) else 1)
+    else:
+        if not args.keep_cache:
+            # a warm cache would hide the cost of the matrix
+            os.environ["DISTANCE_CACHE_DIR"] = ""
+        benchmark(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Load generator for server.py
+
+Sends the fixtures to a running server from a number of concurrent
+clients and reports the throughput, the p50/p99 latency and the status
+codes. Start the server first, e.g. python ../server.py --workers 4
+
+    python load_server.py --requests 200 --concurrency 16 --fixture vrp_20 tsp_10
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import itertools
+import threading
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from six.moves import http_client
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+def client(host, port, bodies, counter, results, deadline_ms):
+    connection = http_client.HTTPConnection(host, port, timeout=600)
+    headers = {"Content-Type": "application/json"}
+    if deadline_ms:
+        headers["X-Deadline-Ms"] = str(deadline_ms)
+    while True:
+        index = next(counter)
+        if index >= len(bodies):
+            break
+        path, body = bodies[index]
+        start = time.time()
+        try:
+            connection.request("POST", path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http_client.HTTPException):
+            connection.close()
+            connection = http_client.HTTPConnection(host, port, timeout=600)
+            status = "error"
+        results.append((path, status, time.time() - start))
+    connection.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fixture", nargs="+", default=["vrp_20", "tsp_10"],
+                        help="fixtures/<handler>_<size> sent in turn")
+    parser.add_argument("--deadline-ms", type=int, default=0, help="X-Deadline-Ms of every request")
+    args = parser.parse_args()
+
+    events = []
+    for name in args.fixture:
+        with open(os.path.join(FIXTURES, name + ".json")) as f:
+            handler = next(prefix for prefix in ("pdvrp_cod", "pdvrp", "vrp", "tsp") if name.startswith(prefix + "_"))
+            events.append(("/" + handler, f.read().encode("utf-8")))
+    bodies = [events[index % len(events)] for index in range(args.requests)]
+
+    # itertools.count's next() is atomic under the GIL
+    counter = itertools.count()
+    results = []
+    threads = [threading.Thread(target=client, args=(args.host, args.port, bodies, counter, results, args.deadline_ms))
+               for _ in range(args.concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    print("{0} requests, {1} clients, {2:.2f} s, {3:.1f} requests/s".format(
+        len(results), args.concurrency, seconds, len(results) / seconds))
+    print("{0:<12} {1:>6} {2:>9} {3:>9} {4:>9}  {5}".format("path", "count", "p50 ms", "p99 ms", "max ms", "status"))
+    by_path = collections.defaultdict(list)
+    for path, status, latency in results:
+        by_path[path].append((status, latency))
+        by_path["all"].append((status, latency))
+    for path in sorted(by_path):
+        latencies = [latency * 1000 for status, latency in by_path[path]]
+        statuses = collections.Counter(status for status, latency in by_path[path])
+        print("{0:<12} {1:>6} {2:9.1f} {3:9.1f} {4:9.1f}  {5}".format(
+            path, len(latencies), percentile(latencies, 0.5), percentile(latencies, 0.99), max(latencies),
+            " ".join("{0}:{1}".format(status, count) for status, count in sorted(statuses.items(), key=str))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Local stand-in for the OSRM table service
+
+Answers /table/v1/driving/ requests with Vincenty distances scaled by a
+road factor, enforces the same --max-table-size limit as osrm-routed and
+can delay every response to simulate network latency.
+
+    python osrm_stub.py --port 5000 --delay 0.05
+    OSRM_URL=http://localhost:5000 python vrp.py
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import gzip
+import argparse
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import distance_matrix
+
+ROAD_FACTOR = 1.3
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class OSRMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; keep-alive clients would
+    # otherwise wait out the delayed ACK on every response
+    disable_nagle_algorithm = True
+    max_table_size = 100
+    delay = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with OSRMHandler.lock:
+            OSRMHandler.requests += 1
+        url = urlsplit(self.path)
+        if not url.path.startswith("/table/v1/driving/"):
+            return self.reply(400, {"code": "InvalidService"})
+        coordinates = [[float(x) for x in pair.split(",")[::-1]]
+                       for pair in url.path[len("/table/v1/driving/"):].split(";")]
+        query = parse_qs(url.query)
+        sources = [int(x) for x in query["sources"][0].split(";")] if "sources" in query else list(range(len(coordinates)))
+        destinations = [int(x) for x in query["destinations"][0].split(";")] if "destinations" in query else list(range(len(coordinates)))
+        if len(coordinates) > self.max_table_size:
+            return self.reply(400, {"code": "TooBig", "message": "Too many table coordinates"})
+
+        matrix = distance_matrix.DistanceMatrix.from_locations(coordinates).values * ROAD_FACTOR
+        distances = matrix[sources][:, destinations].round(1).tolist()
+        time.sleep(self.delay)
+        self.reply(200, {"code": "Ok", "distances": distances})
+
+    def reply(self, code, body):
+        content = json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=UTF-8"}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content, 1)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=0, delay=0.0, max_table_size=100):
+    """Starts the stub in a background thread and returns the server"""
+    OSRMHandler.delay = delay
+    OSRMHandler.max_table_size = max_table_size
+    server = ThreadingHTTPServer(("127.0.0.1", port), OSRMHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--max-table-size", type=int, default=100)
+    args = parser.parse_args()
+    server = serve(args.port, args.delay, args.max_table_size)
+    print("OSRM stub listening on http://127.0.0.1:{0}".format(server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Removing and inserting DistanceMatrix nodes against matrices built from scratch
+
+    python -m pytest test_distance_matrix.py
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from distance_matrix import DistanceMatrix
+
+def random_values(size, seed=0):
+    values = np.random.RandomState(seed).randint(1, 10000, (size, size)).astype(np.float64)
+    np.fill_diagonal(values, 0)
+    return values
+
+def reads(matrix):
+    """Every way the solver and the printers read the matrix"""
+    size = len(matrix)
+    return (matrix.values.copy(),
+            np.array([[matrix.get(i, j) for j in range(size)] for i in range(size)]),
+            np.array([list(matrix[i]) for i in range(size)]),
+            np.array(list(matrix.flat)).reshape(size, size))
+
+class RemoveInsertTest(unittest.TestCase):
+    def assert_matrix(self, matrix, expected):
+        self.assertEqual(len(matrix), len(expected))
+        for read in reads(matrix):
+            assert_array_equal(read, expected)
+
+    def test_insert_after_remove(self):
+        values = random_values(6)
+        matrix = DistanceMatrix(values)
+        matrix.remove(2)
+        self.assert_matrix(matrix, values[np.ix_([0, 1, 3, 4, 5], [0, 1, 3, 4, 5])])
+        # node 5 of the original, index 4 once node 2 is gone
+        matrix.remove(4)
+        self.assert_matrix(matrix, values[np.ix_([0, 1, 3, 4], [0, 1, 3, 4])])
+
+        order = [0, 1, 2, 3, 4]
+        matrix.insert(2, values[2, order], values[order, 2])
+        self.assert_matrix(matrix, values[np.ix_(order, order)])
+        order = [0, 1, 2, 3, 4, 5]
+        matrix.insert(5, values[5, order], values[order, 5])
+        self.assert_matrix(matrix, values[np.ix_(order, order)])
+
+    def test_changes_without_reads_in_between(self):
+        # the block is only rebuilt (_compact) on the read after all changes
+        values = random_values(8, 1)
+        matrix = DistanceMatrix(values[:6, :6])
+        matrix.remove(1)
+        # node 4 of the original
+        matrix.remove(3)
+        order = [0, 7, 2, 3, 5]
+        matrix.insert(1, values[7, order], values[order, 7])
+        order = [0, 7, 2, 3, 6, 5]
+        matrix.insert(4, values[6, order], values[order, 6])
+        self.assert_matrix(matrix, values[np.ix_(order, order)])
+
+    def test_insert_grows_the_buffer(self):
+        values = random_values(12, 2)
+        matrix = DistanceMatrix(values[:3, :3])
+        for node in range(3, 12):
+            order = list(range(node + 1))
+            matrix.insert(node, values[node, order], values[order, node])
+            self.assert_matrix(matrix, values[np.ix_(order, order)])
+        self.assertGreaterEqual(matrix.nbytes, 12 * 12 * 4)
+
+    def test_insert_keeps_the_transport_mode(self):
+        values = random_values(5, 3)
+        order = [0, 1, 4, 2, 3]
+        for ignore_from_depot, ignore_to_depot in ((True, False), (False, True)):
+            matrix = DistanceMatrix(values[:4, :4], ignore_from_depot, ignore_to_depot)
+            matrix.insert(2, values[4, order], values[order, 4])
+            expected = DistanceMatrix(values[np.ix_(order, order)], ignore_from_depot, ignore_to_depot)
+            self.assert_matrix(matrix, expected.values)
+
+    def test_depot_stays(self):
+        matrix = DistanceMatrix(random_values(3))
+        with self.assertRaises(ValueError):
+            matrix.remove(0)
+        with self.assertRaises(ValueError):
+            matrix.insert(0, [0, 1, 2, 3], [0, 1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""tsp_batch over OSRM with forked workers, against the local OSRM stub
+
+    python -m pytest test_tsp_batch.py
+"""
+import io
+import os
+import sys
+import json
+import random
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import matrix_cache
+import osrm_client
+import osrm_stub
+import tsp
+
+def random_points(count, seed):
+    generator = random.Random(seed)
+    return [[round(10.75 + generator.uniform(0, 0.1), 6), round(106.65 + generator.uniform(0, 0.1), 6)]
+            for _ in range(count)]
+
+class OSRMBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = osrm_stub.serve(delay=0.01)
+        self.saved = osrm_client.OSRM_URL, matrix_cache.CACHE_DIR, matrix_cache._default_cache
+        osrm_client.OSRM_URL = "http://127.0.0.1:%d" % self.server.server_address[1]
+        # every route must fetch its table
+        matrix_cache.CACHE_DIR, matrix_cache._default_cache = "", None
+
+    def tearDown(self):
+        osrm_client.OSRM_URL, matrix_cache.CACHE_DIR, matrix_cache._default_cache = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, event):
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = handler({"body": json.dumps(event)}, None)
+        self.assertEqual(response["statusCode"], 200)
+        return json.loads(response["body"])
+
+    def test_workers_do_not_share_connections(self):
+        # leaves a kept-alive connection in the pool the workers inherit
+        self.handle(tsp.tsp, {"points": random_points(5, 0), "transport_mode": "1N1",
+                              "distance_calculation": "OSRM", "time_budget_ms": 100})
+        routes = [{"points": random_points(3 + index % 6, index + 1), "time_budget_ms": 100}
+                  for index in range(32)]
+        body = self.handle(tsp.tsp_batch, {"routes": routes, "transport_mode": "1N", "workers": 4,
+                                           "distance_calculation": "OSRM"})
+
+        self.assertEqual(len(body["routes"]), len(routes))
+        for route, result in zip(routes, body["routes"]):
+            self.assertEqual(result["status"], 200, result.get("title"))
+            self.assertEqual(sorted(map(tuple, result["route"])), sorted(map(tuple, route["points"])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""Persistent cache of pairwise distances"""
+import os
+import fcntl
+import time
+
+import lazy_imports
+
+np = lazy_imports.module("numpy")
+
+# the cache survives warm invocations in /tmp, or any directory given here
+CACHE_DIR = os.environ.get("DISTANCE_CACHE_DIR", "/tmp")
+# maximum number of cached pairs, 16 bytes each on disk
+CACHE_ENTRIES = int(os.environ.get("DISTANCE_CACHE_ENTRIES", 1 << 21))
+# coordinates are rounded to 6 decimals (~0.1 m) before they are hashed
+PRECISION = 6
+
+BACKENDS = {"VINCENTY": 1, "OSRM": 2}
+# VINCENTY is symmetric so both directions share one entry
+SYMMETRIC = {"VINCENTY": True, "OSRM": False}
+
+WAYS = 8
+RECORD = [("key", "<u8"), ("distance", "<i4"), ("used", "<u4")]
+
+##################
+# Distance Cache #
+##################
+# The file is a set-associative table: a pair hashes to one set of WAYS
+# slots and, when the set is full, replaces the least recently used slot.
+# The file never grows past CACHE_ENTRIES records.
+
+def _mix(keys):
+    """splitmix64 finalizer, spreads the bits of uint64 keys"""
+    keys = keys ^ (keys >> np.uint64(30))
+    keys = keys * np.uint64(0xbf58476d1ce4e5b9)
+    keys = keys ^ (keys >> np.uint64(27))
+    keys = keys * np.uint64(0x94d049bb133111eb)
+    return keys ^ (keys >> np.uint64(31))
+
+def _point_keys(locations):
+    coords = np.array([[loc[0], loc[1]] for loc in locations], dtype=np.float64).reshape(-1, 2)
+    scaled = np.rint(coords * 10 ** PRECISION).astype(np.int64).view(np.uint64)
+    return _mix(_mix(scaled[:, 0]) ^ scaled[:, 1])
+
+def pair_keys(locations, from_nodes, to_nodes, backend):
+    """Returns the cache keys of the arcs from_nodes[k] -> to_nodes[k]"""
+    points = _point_keys(locations)
+    first, second = points[from_nodes], points[to_nodes]
+    if SYMMETRIC[backend]:
+        first, second = np.minimum(first, second), np.maximum(first, second)
+    keys = _mix(_mix(first + np.uint64(BACKENDS[backend])) ^ second)
+    # 0 marks an empty slot
+    keys[keys == 0] = 1
+    return keys
+
+class DistanceCache(object):
+    """Memory-mapped, size-capped LRU cache of distances in whole meters"""
+    def __init__(self, path, entries=CACHE_ENTRIES):
+        self._path = path
+        self._sets = max(1, entries // WAYS)
+        size = self._sets * WAYS * np.dtype(RECORD).itemsize
+        with open(path, "ab") as f:
+            if f.tell() != size:
+                f.truncate(size)
+        self._file = open(path, "r+b")
+        self._table = np.memmap(self._file, dtype=RECORD, mode="r+", shape=(self._sets, WAYS))
+
+    @property
+    def path(self):
+        return self._path
+
+    def lookup(self, keys):
+        """Returns (found, distances) for an array of keys"""
+        sets = (keys % np.uint64(self._sets)).astype(np.int64)
+        fcntl.flock(self._file, fcntl.LOCK_SH)
+        try:
+            rows = self._table[sets]
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        match = rows["key"] == keys[:, None]
+        found = match.any(axis=1)
+        ways = match.argmax(axis=1)
+        distances = rows["distance"][np.arange(len(keys)), ways]
+        # refresh the hits; a lost update only makes eviction less exact
+        self._table["used"][sets[found], ways[found]] = int(time.time())
+        return found, distances
+
+    def store(self, keys, distances):
+        """Stores distances (meters) under keys, evicting the LRU slot of full sets"""
+        keep = np.isfinite(distances)
+        keys, first = np.unique(keys[keep], return_index=True)
+        distances = distances[keep][first]
+        now = int(time.time())
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            pending = np.arange(len(keys))
+            # one key per set and round, so slots picked in a round never collide
+            while len(pending):
+                sets = (keys[pending] % np.uint64(self._sets)).astype(np.int64)
+                _, first = np.unique(sets, return_index=True)
+                batch, sets = pending[first], sets[first]
+                rows = self._table[sets]
+                match = rows["key"] == keys[batch][:, None]
+                # overwrite the same key, else the oldest slot (empty slots have used == 0)
+                ways = np.where(match.any(axis=1), match.argmax(axis=1), rows["used"].argmin(axis=1))
+                self._table["key"][sets, ways] = keys[batch]
+                self._table["distance"][sets, ways] = np.rint(distances[batch])
+                self._table["used"][sets, ways] = now
+                pending = np.delete(pending, first)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def flush(self):
+        self._table.flush()
+
+_default_cache = None
+
+def default_cache():
+    """Gets the process wide cache, or None when it is disabled or unavailable"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = False
+        if CACHE_DIR:
+            try:
+                _default_cache = DistanceCache(os.path.join(CACHE_DIR, "distance_cache.bin"))
+            except (IOError, OSError) as e:
+                print("Distance cache disabled: " + str(e))
+    return _default_cache or None
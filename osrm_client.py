@@ -0,0 +1,193 @@
+"""Client for the OSRM table service"""
+import os
+import re
+import time
+import gzip
+import socket
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import lazy_imports
+
+np = lazy_imports.module("numpy")
+
+OSRM_URL = os.environ.get("OSRM_URL", "https://bi.ahamove.com/osrm")
+# the server rejects tables with more coordinates than its --max-table-size
+MAX_TABLE_SIZE = int(os.environ.get("OSRM_MAX_TABLE_SIZE", 100))
+# number of tiles fetched at the same time
+CONCURRENCY = int(os.environ.get("OSRM_CONCURRENCY", 8))
+# seconds to connect / wait for a response
+TIMEOUT = float(os.environ.get("OSRM_TIMEOUT", 10))
+# extra attempts after a failed request, waiting BACKOFF * 2^attempt in between
+RETRIES = int(os.environ.get("OSRM_RETRIES", 2))
+BACKOFF = float(os.environ.get("OSRM_BACKOFF", 0.2))
+# ask for gzip bodies, tables compress ~3x; pointless against a local server
+GZIP = os.environ.get("OSRM_GZIP", "1") != "0"
+
+class OSRMError(Exception):
+    """The OSRM server answered with an error"""
+
+###################
+# Connection Pool #
+###################
+# Idle keep-alive connections live at module level, so a warm Lambda
+# container reuses them across invocations instead of paying the TCP and
+# TLS handshakes on every table request. A forked child must call
+# forget_connections() before its first request, or parent and child would
+# read each other's responses off the same sockets.
+_pool = []
+_pool_lock = threading.Lock()
+
+def forget_connections():
+    """Empties the pool of a forked child without closing the connections,
+    whose sockets the parent still uses"""
+    global _pool, _pool_lock
+    _pool = []
+    _pool_lock = threading.Lock()
+
+def _connect(url):
+    if url.scheme == "https":
+        return http.client.HTTPSConnection(url.hostname, url.port, timeout=TIMEOUT)
+    return http.client.HTTPConnection(url.hostname, url.port, timeout=TIMEOUT)
+
+def _acquire(url):
+    """Returns (connection, reused)"""
+    with _pool_lock:
+        for index in range(len(_pool) - 1, -1, -1):
+            if _pool[index][0] == url.netloc:
+                return _pool.pop(index)[1], True
+    return _connect(url), False
+
+def _release(url, connection):
+    with _pool_lock:
+        if len(_pool) < CONCURRENCY:
+            _pool.append((url.netloc, connection))
+            return
+    connection.close()
+
+def get(path):
+    """GETs OSRM_URL + path and returns the raw (decompressed) body.
+
+    Connection failures, timeouts and 5xx/429 answers are retried with
+    exponential backoff; a pooled connection the server already closed is
+    replaced at once.
+    """
+    url = urllib.parse.urlsplit(OSRM_URL)
+    target = url.path.rstrip("/") + path
+    attempt = 0
+    while True:
+        connection, reused = _acquire(url)
+        try:
+            connection.request("GET", target, headers={"Accept-Encoding": "gzip" if GZIP else "identity"})
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, socket.error) as e:
+            connection.close()
+            # only a closed keep-alive connection; a timeout counts as an attempt
+            if reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)):
+                continue
+            error = e
+        else:
+            if response.getheader("Connection", "").lower() == "close":
+                connection.close()
+            else:
+                _release(url, connection)
+            if response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            if response.status == 200:
+                return body
+            error = OSRMError("OSRM returned " + str(response.status) + ": " + body.decode("UTF-8", "replace")[:200])
+            if response.status < 500 and response.status != 429:
+                raise error
+        if attempt >= RETRIES:
+            raise error
+        time.sleep(BACKOFF * 2 ** attempt)
+        attempt += 1
+
+#################
+# Table Service #
+#################
+# the "]]" closing the distances, whatever whitespace the server puts in it
+_DISTANCES_END = re.compile(br"\]\s*\]")
+
+def parse_distances(body, size=None):
+    """Parses the "distances" of a table response into a flat float array.
+
+    Goes straight from the response bytes to numpy without building the
+    nested lists of json.loads, one row at a time; unreachable pairs (null)
+    become nan.
+    """
+    start = body.find(b'"distances":')
+    end = _DISTANCES_END.search(body, start) if start >= 0 else None
+    if end is None:
+        raise OSRMError("OSRM returned no distances: " + body.decode("UTF-8", "replace")[:200])
+    rows = []
+    # every row ends with "]", dropping the brackets and blanks leaves its list
+    for row in body[start + len(b'"distances":'):end.start()].split(b"]"):
+        row = row.translate(None, b"[] \t\r\n").strip(b",")
+        if row:
+            try:
+                rows.append(np.array(row.replace(b"null", b"nan").split(b","), dtype=np.float64))
+            except ValueError as e:
+                raise OSRMError("OSRM returned malformed distances: " + str(e)[:200])
+    distances = np.concatenate(rows) if rows else np.empty(0)
+    if size is not None and len(distances) != size:
+        raise OSRMError("OSRM returned " + str(len(distances)) + " distances, expected " + str(size))
+    return distances
+
+def _request(locations, sources=None, destinations=None):
+    """Requests one table as a flat array; unreachable pairs come back as nan"""
+    path = "/table/v1/driving/"
+    path += ";".join(str(loc[1]) + "," + str(loc[0]) for loc in locations)
+    path += "?annotations=distance"
+    if sources is not None:
+        path += "&sources=" + ";".join(str(index) for index in sources)
+    if destinations is not None:
+        path += "&destinations=" + ";".join(str(index) for index in destinations)
+    rows = len(locations) if sources is None else len(sources)
+    cols = len(locations) if destinations is None else len(destinations)
+    return parse_distances(get(path), rows * cols)
+
+def _request_tile(locations, sources, destinations):
+    """Requests the table between two lists of indices, sending only their coordinates"""
+    coordinates = [locations[index] for index in sources] + [locations[index] for index in destinations]
+    return _request(
+        coordinates,
+        range(len(sources)),
+        range(len(sources), len(sources) + len(destinations)))
+
+def table(locations, sources=None, destinations=None, concurrency=None):
+    """Gets the OSRM distances in meters between the sources and destinations.
+
+    sources and destinations are indices into locations (all of them when
+    None). Tables over MAX_TABLE_SIZE coordinates are split into tiles of
+    source and destination blocks. At most concurrency tiles (CONCURRENCY by
+    default) are in flight at once, and each one is copied into the
+    len(sources) x len(destinations) result as soon as it arrives.
+    """
+    if sources is None and destinations is None and len(locations) <= MAX_TABLE_SIZE:
+        return _request(locations).reshape(len(locations), len(locations))
+
+    sources = list(range(len(locations))) if sources is None else list(sources)
+    destinations = list(range(len(locations))) if destinations is None else list(destinations)
+    if len(sources) + len(destinations) <= MAX_TABLE_SIZE:
+        return _request_tile(locations, sources, destinations).reshape(len(sources), len(destinations))
+
+    block = max(1, MAX_TABLE_SIZE // 2)
+    tiles = [(slice(row, row + block), slice(col, col + block))
+             for row in range(0, len(sources), block)
+             for col in range(0, len(destinations), block)]
+
+    distances = np.empty((len(sources), len(destinations)))
+    workers = max(1, min(concurrency or CONCURRENCY, len(tiles)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict(
+            (pool.submit(_request_tile, locations, sources[rows], destinations[cols]), (rows, cols))
+            for rows, cols in tiles)
+        for future in as_completed(futures):
+            rows, cols = futures.pop(future)
+            tile = distances[rows, cols]
+            tile[...] = future.result().reshape(tile.shape)
+    return distances
@@ -1,11 +1,5 @@
 """Vehicle Routing Problem"""
 from __future__ import print_function
-from six.moves import xrange
-from ortools.constraint_solver import pywrapcp
-from ortools.constraint_solver import routing_enums_pb2
-
-#time for tester
-import time
 
 import csv
 import random
@@ -14,14 +8,18 @@ import json
 import pdvrp_constraints as constraints
 import pdvrp_data_problem as data_problem
 import pdvrp_printer as printer
+import routing_transits
+import search_control
+import warm_start
+import timings
 
-def return_lambda_gateway_response(code, body):
-    return {"statusCode": code, "body": json.dumps(body)}
+def return_lambda_gateway_response(code, body, timer=None):
+    return {"statusCode": code, "body": json.dumps(timings.response_body(timer, code, body))}
 
 def get_routing_assignment(data, routing, assignment, distance_matrix, result_mode):
     cluster = []
     violated_cluster = []
-    for vehicle_id in xrange(data.num_vehicles):
+    for vehicle_id in range(data.num_vehicles):
         if routing.IsVehicleUsed(assignment, vehicle_id):
             index = routing.Start(vehicle_id)
             index = assignment.Value(routing.NextVar(index))
@@ -53,77 +51,90 @@ def get_routing_assignment(data, routing, assignment, distance_matrix, result_mo
 ########
 def handle(event, context):
 
-    start_time = time.time()
-
-    try:
-        body = event.get('body')
-        event = json.loads(body)
-
-        depot = event["depot"]
-        num_vehicles = event["vehicle_num"]
-        orders = event["orders"]
-        maximum_distance = event.get("max_distance", 0)
-        maximum_parcels = event.get("vehicle_capacity", 20)
-        distance_calculation = event.get("distance_calculation", "VINCENTY")
-        result_mode = event.get("result_mode", "ORDERS")
-
-    except KeyError as e:
-        print("Missing required input: " + str(e))
-        cluster = {"title": "Missing required input: " + str(e)}
-        return return_lambda_gateway_response(400, cluster)
-
-    if maximum_distance < 0 or num_vehicles <= 0 or maximum_parcels <= 0:
+    timer = timings.PhaseTimer("pdvrp")
+
+    with timer.phase("parse"):
+        try:
+            body = event.get('body')
+            event = json.loads(body)
+
+            depot = event["depot"]
+            num_vehicles = event["vehicle_num"]
+            orders = event["orders"]
+            maximum_distance = event.get("max_distance", 0)
+            maximum_parcels = event.get("vehicle_capacity", 20)
+            distance_calculation = event.get("distance_calculation", "VINCENTY")
+            result_mode = event.get("result_mode", "ORDERS")
+            time_budget_ms = event.get("time_budget_ms", 0)
+            # the "cluster" of an earlier response for the same orders, if any
+            previous_cluster = event.get("previous_cluster")
+            # return the time spent in each phase in the response
+            timer.report = event.get("timings", False)
+
+        except KeyError as e:
+            print("Missing required input: " + str(e))
+            cluster = {"title": "Missing required input: " + str(e)}
+            return return_lambda_gateway_response(400, cluster, timer)
+
+    if maximum_distance < 0 or time_budget_ms < 0 or num_vehicles <= 0 or maximum_parcels <= 0:
         cluster = {"title": "Numerical input must be positive"}
-        return return_lambda_gateway_response(400, cluster)
+        return return_lambda_gateway_response(400, cluster, timer)
 
     if distance_calculation != "VINCENTY" and distance_calculation != "OSRM":
         cluster = {"title": "Invalid distance_calculation"}
-        return return_lambda_gateway_response(400, cluster)
+        return return_lambda_gateway_response(400, cluster, timer)
 
     if result_mode != "ORDERS" and result_mode != "COORDINATES":
         cluster = {"title": "Invalid result_mode"}
-        return return_lambda_gateway_response(400, cluster)
+        return return_lambda_gateway_response(400, cluster, timer)
 
     # Instantiate the data problem.
     data = data_problem.DataProblem(num_vehicles, depot, orders, maximum_distance, maximum_parcels, distance_calculation)
 
-    if distance_calculation == "OSRM" and data.num_locations > 100:
-        cluster = {"title": "Error: OSRM reach the limit number of points. Please switch to Vincenty"}
-        return return_lambda_gateway_response(400, cluster)
-
     # Define weight of each edge
-    distance = constraints.CreateDistanceEvaluator(data)
-    distance_matrix = distance.get_distance_matrix()
-    distance_evaluator = distance.distance_evaluator
-    parcels_evaluator = distance.parcels_evaluator
+    with timer.phase("matrix"):
+        distance = constraints.CreateDistanceEvaluator(data)
+        distance_matrix = distance.get_distance_matrix()
     # Create Routing Model
-    routing = pywrapcp.RoutingModel(data.num_locations, data.num_vehicles, data.depot)
-    
-    if data.num_locations > 100:
-        routing.SetArcCostEvaluatorOfAllVehicles(distance.cluster_distance_evaluator)
-    else:
-        routing.SetArcCostEvaluatorOfAllVehicles(distance_evaluator)
-    constraints.add_pickup_delivery(routing, data)
-    constraints.add_parcels_dimension(routing, data, parcels_evaluator)
-    if maximum_distance != 0:
-        constraints.add_distance_soft(routing, data, distance_evaluator)
-    # Setting first solution heuristic (cheapest addition).
-    search_parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
-    search_parameters.time_limit_ms = 10000
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC)
+    with timer.phase("model"):
+        routing = routing_transits.routing_model(data.num_locations, data.num_vehicles, data.depot)
+
+        if data.num_locations > 100:
+            routing_transits.set_arc_costs(routing, distance.get_cluster_distance_matrix())
+        else:
+            routing_transits.set_arc_costs(routing, distance_matrix)
+        constraints.add_pickup_delivery(routing, data)
+        constraints.add_parcels_dimension(routing, data)
+        if maximum_distance != 0:
+            constraints.add_distance_soft(routing, data, distance_matrix)
+        # Setting first solution heuristic (cheapest addition).
+        search_parameters = search_control.default_parameters("AUTOMATIC")
+        search_parameters.time_limit_ms = time_budget_ms or search_control.time_budget_ms(
+            data.num_locations, data.num_vehicles, 10000)
     # Solve the problem.
-    assignment = routing.SolveWithParameters(search_parameters)
+    initial_routes = None
+    if previous_cluster:
+        with timer.phase("warm_start"):
+            routes, missing = warm_start.map_routes(
+                previous_cluster, data.locations, data.num_vehicles, data.orders_index)
+            routes, broken = warm_start.split_pairs(routes, [(i, i + 1) for i in range(1, data.num_locations, 2)])
+            print("Previous plan: " + str(len(broken)) + " orders to insert")
+            initial_routes = warm_start.insert_pairs(routes, broken, distance_matrix, data.num_vehicles)
+    with timer.phase("solve"):
+        assignment = search_control.solve(routing, search_parameters, initial_routes)
 
     if assignment is None:
         print("No solution found")
         result = "No solution found"
     else:
-        p = printer.ConsolePrinter(data, routing, assignment, distance_matrix)
-        p.print()
-        print("Cost: " + str(assignment.ObjectiveValue()))
-        result = get_routing_assignment(data, routing, assignment, distance_matrix, result_mode)
+        with timer.phase("printing"):
+            p = printer.ConsolePrinter(data, routing, assignment, distance_matrix)
+            p.print()
+            print("Cost: " + str(assignment.ObjectiveValue()))
+        timer.objective = assignment.ObjectiveValue()
+        with timer.phase("extraction"):
+            result = get_routing_assignment(data, routing, assignment, distance_matrix, result_mode)
 
-    print("\nThe program took " + str(time.time() - start_time) + " seconds to run")
+    print("\nThe program took " + str(timer.elapsed()) + " seconds to run")
 
-    return return_lambda_gateway_response(200, result)
\ No newline at end of file
+    return return_lambda_gateway_response(200, result, timer)
\ No newline at end of file
@@ -1,76 +1,51 @@
 from __future__ import print_function
-from six.moves import xrange
-from ortools.constraint_solver import pywrapcp
-from ortools.constraint_solver import routing_enums_pb2
 
-#for http requests
-import urllib.request
-import json
+import functools
 
 import sys
-from geopy.distance import vincenty
+import barriers
+import distance_matrix
+import matrix_cache
+import routing_transits
+import vrp_constraints
 
 #######################
 # Problem Constraints #
 #######################
-def vincenty_distance(pos_1, pos_2):
-    pos_1 = (pos_1[0], pos_1[1])
-    pos_2 = (pos_2[0], pos_2[1])
-    return vincenty(pos_1, pos_2).meters
-
 class CreateDistanceEvaluator(object): # pylint: disable=too-few-public-methods
     """Creates callback to return distance between points."""
     def __init__(self, data):
         """Initializes the distance matrix."""
         self._distances = {}
+        self._locations = list(data.locations)
+        self._crossings = None
 
         # complete distance matrix
         # precompute distance between location to have distance callback in O(1)
         if data.distance_calculation == "OSRM":
-            url = "https://bi.ahamove.com/osrm/table/v1/driving/"
-            for loc in data.locations:
-                url += str(loc[1]) + "," + str(loc[0]) + ";"
-            url = url[:-1] + "?annotations=distance"
-            response = urllib.request.urlopen(url).read().decode('UTF-8')
-            contents = json.loads(response)["distances"]
-            for index in xrange(data.num_locations):
-                contents[index][0] = 0
-
-            self._distances = contents
+            import osrm_client
+            contents = distance_matrix.osrm_distances(
+                data.locations, functools.partial(osrm_client.table, data.locations), matrix_cache.default_cache())
+            self._distances = distance_matrix.DistanceMatrix.from_rows(
+                contents, ignore_to_depot=True)
         else:
-            for from_node in xrange(data.num_locations):
-                self._distances[from_node] = {}
-                for to_node in xrange(data.num_locations):
-                    # ignore distance from other back to depot
-                    if from_node == to_node or from_node == 0 or to_node == 0:
-                        self._distances[from_node][to_node] = 0
-                    else:
-                        distance = (vincenty_distance(
-                                data.locations[from_node],
-                                data.locations[to_node]))
-                        self._distances[from_node][to_node] = distance
+            # ignore distance from other back to depot
+            self._distances = distance_matrix.DistanceMatrix.from_locations(
+                data.locations, ignore_from_depot=True, ignore_to_depot=True,
+                cache=matrix_cache.default_cache())
 
     def get_distance_matrix(self):
         return self._distances
 
-    def distance_evaluator(self, from_node, to_node):
-        return self._distances[from_node][to_node]
-
-    def parcels_evaluator(self, from_node, to_node):
-        if from_node == 0:
-            return 0
-        elif from_node % 2 == 0:
-            return -1
-        else:
-            return 1
+    def get_crossings(self):
+        """The arcs crossing a barrier of barriers.BARRIER_FILE, None without one"""
+        if self._crossings is None:
+            self._crossings = barriers.crossings(self._locations)
+        return self._crossings
 
     # add cost if in cluster mode
-    def cluster_distance_evaluator(self, from_node, to_node):
-        # if distance more than 500m -> potential for crossing the river -> add more cost
-        if self._distances[from_node][to_node] > 500:
-            return self._distances[from_node][to_node] + 1000
-        else:
-            return self._distances[from_node][to_node]
+    def get_cluster_distance_matrix(self):
+        return vrp_constraints.cluster_distance_matrix(self._distances, self.get_crossings(), penalty=1000)
 
 def add_pickup_delivery(routing, data):
     i = 1
@@ -78,35 +53,33 @@ def add_pickup_delivery(routing, data):
         routing.AddPickupAndDelivery(i, i + 1)
         i = i + 2
 
-def add_distance_dimension(routing, data, distance_evaluator):
+def add_distance_dimension(routing, data, matrix):
     """Add Global Span constraint"""
     distance = "Distance"
-    routing.AddDimension(
-        distance_evaluator,
-        0, # null slack
+    routing_transits.add_matrix_dimension(
+        routing,
+        matrix,
         data.maximum_distance, # maximum distance per vehicle
-        True, # start cumul to zero
         distance)
 
-def add_parcels_dimension(routing, data, parcels_evaluator):
+def add_parcels_dimension(routing, data):
     parcel = "Parcels"
-    routing.AddDimension(
-        parcels_evaluator,
-        0, # null slack
-        data.maximum_parcels, # maximum distance per vehicle
-        True, # start cumul to zero
+    # pick up one parcel at odd nodes, deliver it at the following even node
+    demands = [0] + [1 if node % 2 != 0 else -1 for node in range(1, data.num_locations)]
+    routing_transits.add_vector_dimension(
+        routing,
+        demands,
+        data.maximum_parcels, # maximum parcels per vehicle
         parcel)
 
-def add_distance_soft(routing, data, distance_evaluator):
+def add_distance_soft(routing, data, matrix):
     distance = "Distance"
-    routing.AddDimension(
-        distance_evaluator,
-        0, # null slack
+    distance_dimension = routing_transits.add_matrix_dimension(
+        routing,
+        matrix,
         sys.maxsize, # maximum distance per vehicle
-        True, # start cumul to zero
         distance)
 
-    distance_dimension = routing.GetDimensionOrDie(distance)
     # cost = 0 if cumul > min_parcels
-    for vehicle_id in xrange(data.num_vehicles):
+    for vehicle_id in range(data.num_vehicles):
         distance_dimension.SetEndCumulVarSoftUpperBound(vehicle_id, data.maximum_distance, 10000)
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""Registers precomputed matrices and vectors with the routing model"""
+import search_control
+
+######################
+# Solver Integration #
+######################
+# Transit values that are known up front are handed to OR-tools as native
+# matrix/vector dimensions, so the local search never calls back into Python
+# for them. Arc costs can only be set through a callback in the bundled
+# pywrapcp; those read a flat int buffer and are cached on the C++ side
+# through max_callback_cache_size. That field belongs to the
+# RoutingModelParameters the model is constructed with, not to the search
+# parameters, so every model is built by routing_model(). The C++ side only
+# holds a wrapper of a python callback: the model keeps the function itself
+# alive in python_callbacks.
+
+def matrix_callback(matrix):
+    """Returns an arc callback over the flat buffer of a DistanceMatrix"""
+    flat = matrix.flat
+    size = len(matrix)
+
+    def callback(from_node, to_node):
+        return flat[from_node * size + to_node]
+
+    return callback
+
+def vector_callback(values):
+    """Returns an arc callback that only depends on the from node"""
+    values = list(values)
+
+    def callback(from_node, to_node):
+        return values[from_node]
+
+    return callback
+
+def keep_callback(routing, callback):
+    """Keeps a callback referenced for as long as the model"""
+    try:
+        routing.python_callbacks.append(callback)
+    except AttributeError:
+        routing.python_callbacks = [callback]
+    return callback
+
+def set_arc_costs(routing, matrix):
+    """Sets the arc cost of all vehicles from a DistanceMatrix"""
+    routing.SetArcCostEvaluatorOfAllVehicles(keep_callback(routing, matrix_callback(matrix)))
+
+def add_matrix_dimension(routing, matrix, capacity, name):
+    """Adds a zero-slack dimension whose transits are the matrix entries"""
+    if hasattr(routing, "AddMatrixDimension"):
+        routing.AddMatrixDimension(matrix.values.tolist(), capacity, True, name)
+    else:
+        routing.AddDimension(keep_callback(routing, matrix_callback(matrix)), 0, capacity, True, name)
+    return routing.GetDimensionOrDie(name)
+
+def add_vector_dimension(routing, values, capacity, name):
+    """Adds a zero-slack dimension whose transit only depends on the from node"""
+    values = [int(value) for value in values]
+    if hasattr(routing, "AddVectorDimension"):
+        routing.AddVectorDimension(values, capacity, True, name)
+    else:
+        routing.AddDimension(keep_callback(routing, vector_callback(values)), 0, capacity, True, name)
+    return routing.GetDimensionOrDie(name)
+
+def cache_callbacks(model_parameters, num_locations):
+    """Lets the solver cache every remaining callback as a matrix; takes the
+    RoutingModelParameters of the model"""
+    if model_parameters.max_callback_cache_size < num_locations:
+        model_parameters.max_callback_cache_size = num_locations
+    return model_parameters
+
+def routing_model(num_locations, num_vehicles, depot):
+    """Creates a RoutingModel that caches its callbacks"""
+    # the SWIG module and protobuf are only loaded once a request gets here
+    from ortools.constraint_solver import pywrapcp
+    parameters = cache_callbacks(search_control.model_parameters(), num_locations)
+    return pywrapcp.RoutingModel(num_locations, num_vehicles, depot, parameters)
@@ -0,0 +1,123 @@
+"""Time budgets and early stopping for the routing search"""
+from __future__ import print_function
+import time
+import collections
+
+# before protobuf, so the vendored google packages skip pkg_resources
+import lazy_imports
+from google.protobuf.internal import api_implementation
+
+import warm_start
+
+# budget = BASE_MS + PER_LOCATION_MS * locations + PER_VEHICLE_MS * vehicles,
+# capped by the limit each handler used to hardcode
+BASE_MS = 2000
+PER_LOCATION_MS = 100
+PER_VEHICLE_MS = 200
+
+# the search stops once the best objective improved by less than IMPROVEMENT
+# (a fraction) over the last WINDOW_FRACTION of the budget, but never looks
+# at a window shorter than MIN_WINDOW_MS
+IMPROVEMENT = 0.005
+WINDOW_FRACTION = 0.2
+MIN_WINDOW_MS = 1000
+
+# "cpp" when protobuf runs on its C++ extension, "python" with the pure
+# Python messages bundled in google/protobuf
+PROTOBUF_IMPLEMENTATION = api_implementation.Type()
+
+#####################
+# Search Parameters #
+#####################
+# DefaultSearchParameters() and DefaultModelParameters() build the
+# parameters in C++ and parse them back into a protobuf message, with the
+# pure Python decoder unless the C++ extension is installed. Each kind of
+# parameters is built once per process and every model and solve gets a
+# CopyFrom of that template instead.
+
+_templates = {}
+
+def _copy(key, build):
+    template = _templates.get(key)
+    if template is None:
+        if not _templates:
+            print("protobuf implementation: " + PROTOBUF_IMPLEMENTATION)
+        template = _templates[key] = build()
+    parameters = type(template)()
+    parameters.CopyFrom(template)
+    return parameters
+
+def default_parameters(first_solution_strategy=None, local_search_metaheuristic=None):
+    """A fresh copy of the default search parameters with the given strategy
+    names set (ortools' defaults when None)"""
+    def build():
+        from ortools.constraint_solver import pywrapcp
+        from ortools.constraint_solver import routing_enums_pb2
+        parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
+        if first_solution_strategy is not None:
+            parameters.first_solution_strategy = getattr(
+                routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy)
+        if local_search_metaheuristic is not None:
+            parameters.local_search_metaheuristic = getattr(
+                routing_enums_pb2.LocalSearchMetaheuristic, local_search_metaheuristic)
+        return parameters
+    return _copy((first_solution_strategy, local_search_metaheuristic), build)
+
+def model_parameters():
+    """A fresh copy of the default model parameters"""
+    def build():
+        from ortools.constraint_solver import pywrapcp
+        return pywrapcp.RoutingModel.DefaultModelParameters()
+    return _copy("model", build)
+
+##################
+# Search Control #
+##################
+def time_budget_ms(num_locations, num_vehicles, maximum_ms):
+    """Picks the time limit of a solve from the size of the instance"""
+    budget = BASE_MS + PER_LOCATION_MS * num_locations + PER_VEHICLE_MS * num_vehicles
+    return int(min(budget, maximum_ms))
+
+class ConvergenceMonitor(object):
+    """Finishes the search when the objective stops improving.
+
+    Called back on every solution the search finds; it keeps the best
+    objective over time and stops the search when the best of window_ms ago
+    is less than `improvement` worse than the current best.
+    """
+    def __init__(self, routing, window_ms, improvement=IMPROVEMENT):
+        self._routing = routing
+        self._window = window_ms / 1000.
+        self._improvement = improvement
+        self._history = collections.deque()
+        self.stopped = False
+        routing.AddAtSolutionCallback(self)
+
+    def __call__(self):
+        now = time.time()
+        objective = self._routing.CostVar().Max()
+        if self._history:
+            objective = min(objective, self._history[-1][1])
+        self._history.append((now, objective))
+        # the reference is the newest entry that is at least a window old
+        while len(self._history) > 1 and self._history[1][0] <= now - self._window:
+            self._history.popleft()
+        since, reference = self._history[0]
+        if now - since >= self._window and reference - objective <= self._improvement * abs(reference):
+            print("Search converged at objective " + str(objective))
+            self.stopped = True
+            self._routing.solver().FinishCurrentSearch()
+
+def solve(routing, search_parameters, routes=None):
+    """SolveWithParameters, finishing early once the search has converged.
+
+    routes, node lists per vehicle, are the first solution when given and
+    feasible.
+    """
+    window_ms = max(MIN_WINDOW_MS, search_parameters.time_limit_ms * WINDOW_FRACTION)
+    monitor = ConvergenceMonitor(routing, window_ms)
+    if routes is not None:
+        initial = warm_start.initial_assignment(routing, search_parameters, routes)
+        if initial is not None:
+            return routing.SolveFromAssignmentWithParameters(initial, search_parameters)
+    return routing.SolveWithParameters(search_parameters)
@@ -0,0 +1,226 @@
+"""Serves the handlers over HTTP from a pool of warm worker processes
+
+    python server.py --port 8080
+
+POST /vrp, /pdvrp, /pdvrp_cod or /tsp with the same JSON body as the Lambda
+event's "body"; the response carries the handler's status code and body.
+GET /health reports the pool and the requests in flight.
+"""
+from __future__ import print_function
+import os
+import json
+import time
+import argparse
+import threading
+import importlib
+import traceback
+import http.server
+import socketserver
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# worker processes, each solving one request at a time
+WORKERS = int(os.environ.get("SERVER_WORKERS", multiprocessing.cpu_count()))
+# requests waiting for a worker on top of the ones being solved; more get 503
+QUEUE_DEPTH = int(os.environ.get("SERVER_QUEUE_DEPTH", 2 * WORKERS))
+# a request not answered within this many ms gets 504; an X-Deadline-Ms
+# header can only shorten it
+DEADLINE_MS = int(os.environ.get("SERVER_DEADLINE_MS", 120000))
+# largest request body accepted
+MAX_BODY_BYTES = int(os.environ.get("SERVER_MAX_BODY_BYTES", 16 << 20))
+
+# path -> (module, entry point)
+HANDLERS = {
+    "/vrp": ("vrp", "handle"),
+    "/pdvrp": ("pdvrp", "handle"),
+    "/pdvrp_cod": ("pdvrp_cod", "handle"),
+    "/tsp": ("tsp", "tsp"),
+}
+# loaded by the handlers on first use; the workers get them preloaded
+# (importing numpy.linalg executes the lazily imported numpy)
+PRELOAD = [
+    "numpy.linalg",
+    "ortools.constraint_solver.pywrapcp",
+    "ortools.constraint_solver.routing_enums_pb2",
+    "ortools.constraint_solver.routing_parameters_pb2",
+    "osrm_client",
+    "multiprocessing.connection",
+]
+
+###########
+# Workers #
+###########
+# The workers are forked from a forkserver: a single-threaded process,
+# started before the HTTP server starts any thread, that imports the whole
+# solver stack once, including what the handlers import lazily, so no
+# request pays for the imports. A pool restarted after a worker died forks
+# its new workers from there too, never from the threaded server, where a
+# lock held by another thread (stdout's, while it logs) would stay locked
+# in the child. Workers may fork again for the solver portfolio.
+
+def _use_forkserver():
+    # ProcessPoolExecutor takes no context before python 3.7
+    multiprocessing.set_start_method("forkserver", force=True)
+    multiprocessing.set_forkserver_preload([module for module, entry in HANDLERS.values()] + PRELOAD)
+
+def _ready():
+    return os.getpid()
+
+def _run(path, body, deadline):
+    """Runs one request in a worker, unless its deadline passed in the queue"""
+    if time.time() >= deadline:
+        return None
+    module, entry = HANDLERS[path]
+    return getattr(importlib.import_module(module), entry)({"body": body}, None)
+
+class SolverPool(object):
+    """A bounded process pool: at most workers + queue_depth requests at once"""
+    def __init__(self, workers=WORKERS, queue_depth=QUEUE_DEPTH):
+        self._workers = max(1, workers)
+        self._slots = threading.BoundedSemaphore(self._workers + max(0, queue_depth))
+        self._lock = threading.Lock()
+        self._executor = None
+        self.in_flight = 0
+        _use_forkserver()
+        self._start()
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(self._workers)
+        # forks every worker now
+        for future in [self._executor.submit(_ready) for _ in range(self._workers)]:
+            future.result()
+
+    def stats(self):
+        return {"workers": self._workers, "in_flight": self.in_flight}
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def submit(self, path, body, deadline):
+        """Returns (code, body): the handler's response, or 503/504/500.
+
+        body must be JSON already; anything the handler raises is a 500.
+
+        A request holds its slot until its worker is done with it, even
+        when it was answered with 504 before.
+        """
+        if not self._slots.acquire(False):
+            return 503, {"title": "Too many requests in flight"}
+        with self._lock:
+            self.in_flight += 1
+            executor = self._executor
+        try:
+            future = executor.submit(_run, path, body, deadline)
+        except BrokenProcessPool:
+            self._done(None)
+            return self._restart(executor)
+        future.add_done_callback(self._done)
+        try:
+            response = future.result(timeout=max(0, deadline - time.time()))
+        except TimeoutError:
+            # a request still in the queue is dropped, a running one finishes
+            future.cancel()
+            return 504, {"title": "Deadline exceeded"}
+        except BrokenProcessPool:
+            return self._restart(executor)
+        except Exception as e:
+            # the handlers answer the requests they reject with 400 themselves
+            print("Request failed: " + traceback.format_exc())
+            return 500, {"title": "Request failed: " + str(e)}
+        if response is None:
+            return 504, {"title": "Deadline exceeded"}
+        if not response:
+            # tsp.tsp returns nothing when it finds no route
+            return 200, "No solution found"
+        return response["statusCode"], json.loads(response["body"])
+
+    def _restart(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                print("A worker died, restarting the pool")
+                executor.shutdown(wait=False)
+                self._start()
+        return 500, {"title": "Worker crashed"}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+##########
+# Server #
+##########
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are separate writes on a kept-alive connection
+    disable_nagle_algorithm = True
+    pool = None
+
+    def _reply(self, code, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, self.pool.stats())
+        else:
+            self._reply(404, {"title": "Not found"})
+
+    def do_POST(self):
+        start = time.time()
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._reply(413, {"title": "Request body too large"})
+            return
+        body = self.rfile.read(length).decode("utf-8")
+        if self.path not in HANDLERS:
+            self._reply(404, {"title": "Not found"})
+            return
+        try:
+            json.loads(body)
+        except ValueError as e:
+            self._reply(400, {"title": "Invalid JSON: " + str(e)})
+            return
+        deadline_ms = min(DEADLINE_MS, int(self.headers.get("X-Deadline-Ms") or DEADLINE_MS))
+        code, result = self.pool.submit(self.path, body, start + deadline_ms / 1000.)
+        self._reply(code, result)
+
+    def log_message(self, format, *args):
+        print("%s %s" % (self.address_string(), format % args))
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    # the accept backlog is not the limit, the pool's queue depth is
+    request_queue_size = 128
+
+def serve(port, host="0.0.0.0", workers=WORKERS, queue_depth=QUEUE_DEPTH):
+    # the pool forks before the server starts any thread
+    RequestHandler.pool = SolverPool(workers, queue_depth)
+    server = Server((host, port), RequestHandler)
+    print("Serving " + ", ".join(sorted(HANDLERS)) + " on " + host + ":" + str(port)
+          + " with " + str(workers) + " workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        RequestHandler.pool.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH)
+    args = parser.parse_args()
+    serve(args.port, args.host, args.workers, args.queue_depth)
+
+if __name__ == '__main__':
+    main()
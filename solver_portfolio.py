@@ -0,0 +1,146 @@
+"""Runs several search strategies on one routing model in parallel"""
+from __future__ import print_function
+import time
+
+import search_control
+
+# (first solution strategy, local search metaheuristic) of each worker; the
+# first entry is what the handlers run on their own
+CONFIGURATIONS = [
+    ("PATH_MOST_CONSTRAINED_ARC", "AUTOMATIC"),
+    ("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH"),
+    ("SAVINGS", "GUIDED_LOCAL_SEARCH"),
+    ("PARALLEL_CHEAPEST_INSERTION", "TABU_SEARCH"),
+    ("PATH_MOST_CONSTRAINED_ARC", "GUIDED_LOCAL_SEARCH"),
+    ("LOCAL_CHEAPEST_INSERTION", "SIMULATED_ANNEALING"),
+    ("CHRISTOFIDES", "GUIDED_LOCAL_SEARCH"),
+    ("GLOBAL_CHEAPEST_ARC", "TABU_SEARCH"),
+]
+
+# time given to the workers past the deadline to send their best solution
+GRACE_MS = 2000
+
+####################
+# Solver Portfolio #
+####################
+# Every worker is a forked process that builds its own RoutingModel from the
+# inherited data and sends its routes back as node lists through a Pipe
+# (multiprocessing.Pool and Queue need /dev/shm, which Lambda does not have).
+# The parent rebuilds the model once and restores the best routes into it,
+# so the caller gets a routing/assignment pair like SolveWithParameters.
+
+def search_parameters(routing, time_limit_ms, first_solution_strategy="PATH_MOST_CONSTRAINED_ARC",
+                      local_search_metaheuristic="AUTOMATIC"):
+    """Creates the search parameters of one configuration"""
+    parameters = search_control.default_parameters(first_solution_strategy, local_search_metaheuristic)
+    parameters.time_limit_ms = int(time_limit_ms)
+    return parameters
+
+def assignment_routes(routing, assignment):
+    """Gets the nodes visited by each vehicle, without its start and end"""
+    routes = []
+    for vehicle_id in range(routing.vehicles()):
+        index = assignment.Value(routing.NextVar(routing.Start(vehicle_id)))
+        route = []
+        while not routing.IsEnd(index):
+            route.append(routing.IndexToNode(index))
+            index = assignment.Value(routing.NextVar(index))
+        routes.append(route)
+    return routes
+
+def _work(build, configuration, deadline, routes, connection):
+    try:
+        routing = build()
+        parameters = search_parameters(routing, max(1, (deadline - time.time()) * 1000), *configuration)
+        assignment = search_control.solve(routing, parameters, routes)
+        if assignment is None:
+            connection.send(None)
+        else:
+            connection.send((assignment.ObjectiveValue(), assignment_routes(routing, assignment)))
+    except Exception as e:
+        print("Portfolio worker " + str(configuration) + " failed: " + str(e))
+        connection.send(None)
+    finally:
+        connection.close()
+
+class PendingSolve(object):
+    """Portfolio workers that are solving in the background"""
+    def __init__(self, build, workers, time_limit_ms, routes=None):
+        self._build = build
+        self._time_limit_ms = time_limit_ms
+        self._deadline = time.time() + time_limit_ms / 1000.
+        # only the portfolio needs multiprocessing, a single solve does not
+        import multiprocessing
+        context = multiprocessing.get_context("fork")
+        self._running = {}
+        for configuration in CONFIGURATIONS[:max(1, workers)]:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_work, args=(build, configuration, self._deadline, routes, sender))
+            process.daemon = True
+            process.start()
+            sender.close()
+            self._running[receiver] = (process, configuration)
+
+    def cancel(self):
+        """Stops every worker that is still solving"""
+        for receiver, (process, configuration) in self._running.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+        self._running = {}
+
+    def best(self):
+        """Waits for the workers and returns (objective, routes, configuration).
+
+        Returns None when no worker found a solution.
+        """
+        from multiprocessing.connection import wait
+        best = None
+        while self._running:
+            timeout = self._deadline + GRACE_MS / 1000. - time.time()
+            ready = wait(list(self._running), max(0, timeout))
+            if not ready:
+                break
+            for receiver in ready:
+                process, configuration = self._running.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    result = None
+                receiver.close()
+                process.join()
+                if result is not None and (best is None or result[0] < best[0]):
+                    best = (result[0], result[1], configuration)
+        for process, configuration in self._running.values():
+            print("Portfolio worker " + str(configuration) + " missed the deadline")
+        self.cancel()
+        return best
+
+    def result(self):
+        """Waits for the workers and returns (routing, assignment, configuration).
+
+        The routing model is rebuilt and the best routes are restored into
+        it; assignment and configuration are None when no worker found a
+        solution.
+        """
+        best = self.best()
+        routing = self._build()
+        if best is None:
+            return routing, None, None
+        objective, routes, configuration = best
+        print("Best portfolio solution: " + str(configuration) + " objective " + str(objective))
+        routing.CloseModelWithParameters(search_parameters(routing, self._time_limit_ms, *configuration))
+        return routing, routing.ReadAssignmentFromRoutes(routes, True), configuration
+
+def start(build, workers, time_limit_ms, routes=None):
+    """Starts solving with the first `workers` configurations in the background.
+
+    build() returns a new, unsolved RoutingModel of the problem. Every
+    worker stops at the same deadline, time_limit_ms from now, and starts
+    from routes when they are given.
+    """
+    return PendingSolve(build, workers, time_limit_ms, routes)
+
+def solve(build, workers, time_limit_ms, routes=None):
+    """Solves with the first `workers` configurations until the deadline"""
+    return start(build, workers, time_limit_ms, routes).result()
@@ -0,0 +1,107 @@
+"""Nearest neighbor queries on projected coordinates"""
+import lazy_imports
+
+np = lazy_imports.module("numpy")
+
+# mean earth radius (m) of the equirectangular projection
+EARTH_RADIUS = 6371008.8
+# a node is split until its halves would hold fewer points than this
+LEAF_SIZE = 32
+
+###############
+# Projections #
+###############
+def project(locations):
+    """Projects [lat, lng] to equirectangular x/y meters around their mean latitude"""
+    coords = np.radians(np.array([[loc[0], loc[1]] for loc in locations], dtype=np.float64).reshape(-1, 2))
+    scale = np.cos(coords[:, 0].mean()) if len(coords) else 1.0
+    return np.column_stack((coords[:, 1] * scale, coords[:, 0])) * EARTH_RADIUS
+
+def estimate_distances(locations):
+    """Straight-line N x N distances in meters on the projection, a cheap
+    stand-in for arcs whose exact distance is never needed"""
+    points = project(locations)
+    return np.hypot(points[:, None, 0] - points[None, :, 0], points[:, None, 1] - points[None, :, 1])
+
+###########
+# KD-Tree #
+###########
+class KDTree(object):
+    """A KD-tree whose leaves are answered as vectorized blocks.
+
+    Every leaf holds at least min_leaf points. A k-nearest query for all the
+    points of a leaf first bounds their k-th distance inside the leaf, then
+    compares them only against the leaves whose boxes are within that bound.
+    """
+    def __init__(self, points, min_leaf=LEAF_SIZE):
+        self._points = np.asarray(points, dtype=np.float64)
+        self._leaves = []
+        self._split(np.arange(len(self._points)), max(1, min_leaf))
+        self._low = np.array([self._points[leaf].min(axis=0) for leaf in self._leaves]).reshape(-1, 2)
+        self._high = np.array([self._points[leaf].max(axis=0) for leaf in self._leaves]).reshape(-1, 2)
+
+    def _split(self, indices, min_leaf):
+        stack = [indices]
+        while stack:
+            indices = stack.pop()
+            if len(indices) < 2 * min_leaf:
+                if len(indices):
+                    self._leaves.append(indices)
+                continue
+            points = self._points[indices]
+            axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+            order = np.argpartition(points[:, axis], len(indices) // 2)
+            stack.append(indices[order[:len(indices) // 2]])
+            stack.append(indices[order[len(indices) // 2:]])
+
+    def query(self, k):
+        """Returns the (N, k) indices and distances of every point's k nearest
+        other points, closest first"""
+        size = len(self._points)
+        k = min(k, size - 1)
+        indices = np.zeros((size, max(k, 0)), dtype=np.int64)
+        distances = np.zeros((size, max(k, 0)))
+        if k <= 0:
+            return indices, distances
+        everything = np.arange(size)
+        for number, leaf in enumerate(self._leaves):
+            points = self._points[leaf]
+            # the k-th distance inside the leaf bounds the true k-th distance
+            if len(leaf) > k:
+                local = _pairwise(points, points)
+                np.fill_diagonal(local, np.inf)
+                radius = np.partition(local, k - 1, axis=1)[:, k - 1].max()
+                gap = np.maximum(0, np.maximum(self._low - self._high[number], self._low[number] - self._high))
+                near = np.flatnonzero(np.hypot(gap[:, 0], gap[:, 1]) <= radius)
+                candidates = np.concatenate([self._leaves[other] for other in near])
+            else:
+                candidates = everything
+            found = _pairwise(points, self._points[candidates])
+            found[leaf[:, None] == candidates[None, :]] = np.inf
+            nearest = np.argpartition(found, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(found, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1)
+            indices[leaf] = candidates[np.take_along_axis(nearest, order, axis=1)]
+            distances[leaf] = np.take_along_axis(nearest_distances, order, axis=1)
+        return indices, distances
+
+def _pairwise(first, second):
+    return np.hypot(first[:, None, 0] - second[None, :, 0], first[:, None, 1] - second[None, :, 1])
+
+def neighbor_arcs(locations, k):
+    """Returns the N x N mask of arcs between each node and its k nearest.
+
+    The mask is symmetric and always allows the arcs from and to the depot
+    (node 0), which every route needs.
+    """
+    size = len(locations)
+    allowed = np.zeros((size, size), dtype=bool)
+    if size == 0:
+        return allowed
+    neighbors, _ = KDTree(project(locations), max(LEAF_SIZE, k + 1)).query(k)
+    allowed[np.repeat(np.arange(size), neighbors.shape[1]), neighbors.reshape(-1)] = True
+    allowed |= allowed.T
+    allowed[0, :] = True
+    allowed[:, 0] = True
+    np.fill_diagonal(allowed, True)
+    return allowed
@@ -0,0 +1,66 @@
+"""Wall time of the phases of one request"""
+from __future__ import print_function
+import json
+import time
+import contextlib
+import collections
+
+##########
+# Timing #
+##########
+class PhaseTimer(object):
+    """Adds up the milliseconds spent in each named phase of a handler.
+
+    A phase entered again (the solve attempts of one model) adds to its
+    total. log() prints every request's timings as one JSON line, with the
+    objective of the returned solution when the handler set it; they are
+    also returned in the response body when the event sets "timings".
+    """
+    def __init__(self, handler):
+        self._handler = handler
+        self._start = time.time()
+        self._phases = collections.OrderedDict()
+        self.report = False
+        self.objective = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._phases[name] = self._phases.get(name, 0) + (time.time() - start) * 1000
+
+    def elapsed(self):
+        """Seconds since the request started"""
+        return time.time() - self._start
+
+    def as_dict(self):
+        timings = {
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "phases": collections.OrderedDict((name, round(ms, 1)) for name, ms in self._phases.items()),
+        }
+        if self.objective is not None:
+            timings["objective"] = self.objective
+        return timings
+
+    def log(self, status, timings=None):
+        """Prints the timings as one JSON line"""
+        line = collections.OrderedDict([("event", "timings"), ("handler", self._handler), ("status", status)])
+        line.update(timings or self.as_dict())
+        print(json.dumps(line))
+
+def response_body(timer, code, body):
+    """Logs the timings and adds them to the body when they were asked for.
+
+    A plain string body ("No solution found") becomes {"title": body} then.
+    """
+    if timer is None:
+        return body
+    timings = timer.as_dict()
+    timer.log(code, timings)
+    if timer.report:
+        if not isinstance(body, dict):
+            body = {"title": body}
+        body = dict(body, timings=timings)
+    return body
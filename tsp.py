@@ -1,19 +1,18 @@
 from __future__ import print_function
-from six.moves import xrange
-from ortools.constraint_solver import pywrapcp
-from ortools.constraint_solver import routing_enums_pb2
 
-import urllib.request
 import json
-from geopy.distance import vincenty
+import time
+import functools
 
-def return_lambda_gateway_response(code, body):
-    return {"statusCode": code, "body": json.dumps(body)}
+import distance_matrix
+import matrix_cache
+import routing_transits
+import search_control
+import timings
+import tsp_heuristics
 
-def vincenty_distance(pos_1, pos_2):
-    pos_1 = (pos_1[0], pos_1[1])
-    pos_2 = (pos_2[0], pos_2[1])
-    return vincenty(pos_1, pos_2).meters
+def return_lambda_gateway_response(code, body, timer=None):
+    return {"statusCode": code, "body": json.dumps(timings.response_body(timer, code, body))}
 
 def create_distance_matrix(locations, transport_mode, distance_calculation):
 # Create the distance matrix.
@@ -22,108 +21,291 @@ def create_distance_matrix(locations, transport_mode, distance_calculation):
   # complete distance matrix
   # precompute distance between location to have distance callback in O(1)
   if distance_calculation == "OSRM":
-    url = "https://bi.ahamove.com/osrm/table/v1/driving/"
-    for loc in locations:
-      url += str(loc[1]) + "," + str(loc[0]) + ";"
-    url = url[:-1] + "?annotations=distance"
-    response = urllib.request.urlopen(url).read().decode('UTF-8')
-    contents = json.loads(response)["distances"]
-                
-    if transport_mode == "N1":
-      for index in xrange(len(locations)):
-        contents[0][index] = 0
-
-    if transport_mode == "1N":
-      for index in xrange(len(locations)):
-          contents[index][0] = 0
-    dist_matrix = contents
+    import osrm_client
+    contents = distance_matrix.osrm_distances(
+      locations, functools.partial(osrm_client.table, locations), matrix_cache.default_cache())
+    dist_matrix = distance_matrix.DistanceMatrix.from_rows(
+      contents,
+      ignore_from_depot=transport_mode == "N1",
+      ignore_to_depot=transport_mode == "1N")
   else:
-    for from_node in xrange(len(locations)):
-      dist_matrix[from_node] = {}
-      for to_node in xrange(len(locations)):
-        if (from_node == to_node) or (transport_mode == "1N" and to_node == 0) or (transport_mode == "N1" and from_node == 0):
-          dist_matrix[from_node][to_node] = 0
-        else:
-          distance = (vincenty_distance(
-            locations[from_node],
-            locations[to_node]))
-          dist_matrix[from_node][to_node] = distance
+    dist_matrix = distance_matrix.DistanceMatrix.from_locations(
+      locations,
+      ignore_from_depot=transport_mode == "N1",
+      ignore_to_depot=transport_mode == "1N",
+      cache=matrix_cache.default_cache())
   return dist_matrix
-def create_distance_callback(dist_matrix):
-  # Create the distance callback.
 
-  def distance_callback(from_node, to_node):
-    return int(dist_matrix[from_node][to_node])
+def solve_route(locations, dist_matrix, transport_mode, time_budget_ms=0, timer=None):
+  """Solves one route and returns its stops as the response lists, None if
+  there is no solution.
+
+  Routes of up to tsp_heuristics.FAST_PATH_MAX_NODES nodes skip OR-tools.
+  """
+  timer = timer or timings.PhaseTimer("tsp")
+  tsp_size = len(locations)
+  num_routes = 1
+  depot = 0
+
+  if tsp_size <= tsp_heuristics.FAST_PATH_MAX_NODES:
+    with timer.phase("solve"):
+      order = tsp_heuristics.solve(dist_matrix.values)
+      cost = tsp_heuristics.tour_cost(dist_matrix.values, order)
+  else:
+    with timer.phase("model"):
+      routing = routing_transits.routing_model(tsp_size, num_routes, depot)
+      search_parameters = search_control.default_parameters()
+      search_parameters.time_limit_ms = time_budget_ms or search_control.time_budget_ms(tsp_size, num_routes, 30000)
+      routing_transits.set_arc_costs(routing, dist_matrix)
+    # Solve the problem.
+    with timer.phase("solve"):
+      assignment = search_control.solve(routing, search_parameters)
+    if not assignment:
+      return None
+
+    with timer.phase("extraction"):
+      # Only one route here; otherwise iterate from 0 to routing.vehicles() - 1.
+      route_number = 0
+      node = routing.Start(route_number)
+      order = []
+      while not routing.IsEnd(node):
+        order.append(node)
+        node = assignment.Value(routing.NextVar(node))
+      cost = assignment.ObjectiveValue()
+
+  timer.objective = int(cost)
+  with timer.phase("extraction"):
+    # Solution cost.
+    print("Total distance: " + str(cost) + "\n")
+
+    # Inspect solution.
+    if transport_mode == "N1":
+      order = order[1:]
+    route = ''
+    cluster = []
 
-  return distance_callback
+    for node in order:
+      cluster.append(locations[node])
+      route += str(node) + ' -> '
+
+    if transport_mode != "1N":
+      route += '0'
+      cluster.append([locations[0]])
+    print("Route:\n\n" + route)
+  return cluster
 
 def tsp(event, context):
+  timer = timings.PhaseTimer("tsp")
   # Create the data.
-  try:
-    body = event.get('body')
-    event = json.loads(body)
-
-    locations = event["points"]
-    transport_mode = event["transport_mode"]
-    distance_calculation = event.get("distance_calculation", "VINCENTY")
-
-  # Error handling
-  except KeyError as e:
-    print("Missing required input: " + str(e))
-    cluster = {"title": "Missing required input: " + str(e)}
-    return return_lambda_gateway_response(400, cluster)
+  with timer.phase("parse"):
+    try:
+      body = event.get('body')
+      event = json.loads(body)
+
+      locations = event["points"]
+      transport_mode = event["transport_mode"]
+      distance_calculation = event.get("distance_calculation", "VINCENTY")
+      time_budget_ms = event.get("time_budget_ms", 0)
+      # return the time spent in each phase in the response
+      timer.report = event.get("timings", False)
+
+    # Error handling
+    except KeyError as e:
+      print("Missing required input: " + str(e))
+      cluster = {"title": "Missing required input: " + str(e)}
+      return return_lambda_gateway_response(400, cluster, timer)
+  if time_budget_ms < 0:
+    cluster = {"title": "Numerical input cannot be negative"}
+    return return_lambda_gateway_response(400, cluster, timer)
   if transport_mode != "1N" and transport_mode != "N1" and transport_mode != "1N1":
     cluster = {"title": "Invalid transport_mode"}
-    return return_lambda_gateway_response(400, cluster)
+    return return_lambda_gateway_response(400, cluster, timer)
     
   if distance_calculation != "VINCENTY" and distance_calculation != "OSRM":
     cluster = {"title": "Invalid distance_calculation"}
-    return return_lambda_gateway_response(400, cluster)
+    return return_lambda_gateway_response(400, cluster, timer)
 
-  if distance_calculation == "OSRM" and len(locations) > 100:
-    cluster = {"title": "Bad request: OSRM cannot be used with more than 100 points"}
-    return return_lambda_gateway_response(400, cluster)
+  with timer.phase("matrix"):
+    dist_matrix = create_distance_matrix(locations, transport_mode, distance_calculation)
+  # Create routing model.
+  if len(locations) > 0:
+    cluster = solve_route(locations, dist_matrix, transport_mode, time_budget_ms, timer)
+    if cluster is not None:
+      return return_lambda_gateway_response(200, {"route": cluster}, timer)
+    else:
+      print('No solution found.')
+  else:
+    print('Specify an instance greater than 0.')
 
-  dist_matrix = create_distance_matrix(locations, transport_mode, distance_calculation)
-  dist_callback = create_distance_callback(dist_matrix)
-  tsp_size = len(locations)
-  num_routes = 1
-  depot = 0
+#########
+# Batch #
+#########
+# tsp_batch solves many independent routes in one invocation. The VINCENTY
+# matrices of all routes are computed in one vectorized pass (route by
+# route when a pair of the pass does not converge), then the
+# routes are dealt round-robin to forked workers (Process + Pipe, as Lambda
+# has no /dev/shm for a multiprocessing.Pool) that send back each result as
+# soon as it is solved. The workers fetch their own OSRM tables on new
+# connections: the kept-alive ones they inherit stay with the parent.
+# Results keep the order of the input and a failing route only fails its
+# own entry.
 
-  # Create routing model.
-  if tsp_size > 0:
-    routing = pywrapcp.RoutingModel(tsp_size, num_routes, depot)
-    search_parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
-    routing.SetArcCostEvaluatorOfAllVehicles(dist_callback)
-    # Solve the problem.
-    assignment = routing.SolveWithParameters(search_parameters)
-    if assignment:
+def _check_route(item, transport_mode):
+  """Returns (points, transport_mode, time_budget_ms) of one batch entry, or
+  raises ValueError"""
+  if not isinstance(item, dict) or "points" not in item:
+    raise ValueError("Missing required input: 'points'")
+  transport_mode = item.get("transport_mode", transport_mode)
+  time_budget_ms = item.get("time_budget_ms", 0)
+  if transport_mode != "1N" and transport_mode != "N1" and transport_mode != "1N1":
+    raise ValueError("Invalid transport_mode")
+  if isinstance(time_budget_ms, bool) or not isinstance(time_budget_ms, (int, float)):
+    raise ValueError("Invalid time_budget_ms")
+  if time_budget_ms < 0:
+    raise ValueError("Numerical input cannot be negative")
+  if len(item["points"]) == 0:
+    raise ValueError("Specify an instance greater than 0.")
+  # one bad point must not break the shared matrix of the batch
+  try:
+    [(float(point[0]), float(point[1])) for point in item["points"]]
+  except (TypeError, ValueError, IndexError, KeyError):
+    raise ValueError("Invalid points")
+  return item["points"], transport_mode, time_budget_ms
 
-      # Solution cost.
-      print("Total distance: " + str(assignment.ObjectiveValue()) + "\n")
+def _vincenty_matrices(location_sets):
+  """The VINCENTY matrix of each route. When the shared pass fails, each
+  route is computed on its own and a failing one gets its exception"""
+  cache = matrix_cache.default_cache()
+  try:
+    return distance_matrix.vincenty_blocks(location_sets, cache)
+  except ValueError:
+    matrices = []
+    for locations in location_sets:
+      try:
+        matrices.append(distance_matrix.vincenty_blocks([locations], cache)[0])
+      except ValueError as e:
+        matrices.append(e)
+    return matrices
 
-      # Inspect solution.
-      # Only one route here; otherwise iterate from 0 to routing.vehicles() - 1.
-      route_number = 0
-      node = routing.Start(route_number)
-      if transport_mode == "N1":
-        node = assignment.Value(routing.NextVar(node)) 
-      start_node = node
-      route = ''
-      cluster = []
+def _solve_item(route, distance_calculation, values):
+  """Solves one checked entry; values is its VINCENTY matrix, None for OSRM"""
+  start = time.time()
+  points, transport_mode, time_budget_ms = route
+  try:
+    if values is None:
+      dist_matrix = create_distance_matrix(points, transport_mode, distance_calculation)
+    else:
+      dist_matrix = distance_matrix.DistanceMatrix(
+        values, ignore_from_depot=transport_mode == "N1", ignore_to_depot=transport_mode == "1N")
+    cluster = solve_route(points, dist_matrix, transport_mode, time_budget_ms)
+    if cluster is None:
+      result = {"status": 200, "title": "No solution found"}
+    else:
+      result = {"status": 200, "route": cluster}
+  except Exception as e:
+    print("Route failed: " + repr(e))
+    result = {"status": 500, "title": "Route failed: " + str(e)}
+  result["time_ms"] = round((time.time() - start) * 1000, 1)
+  return result
 
-      while not routing.IsEnd(node):
-        cluster.append(locations[node])
-        route += str(node) + ' -> '
-        node = assignment.Value(routing.NextVar(node))
-      
-      if transport_mode != "1N":
-        route += '0'
-        cluster.append([locations[0]])
-      print("Route:\n\n" + route)
+def _work(indices, routes, distance_calculation, matrices, connection):
+  if distance_calculation == "OSRM":
+    import osrm_client
+    osrm_client.forget_connections()
+  try:
+    for index in indices:
+      connection.send((index, _solve_item(routes[index], distance_calculation, matrices[index])))
+  finally:
+    connection.close()
+
+def solve_routes(routes, distance_calculation, matrices, workers):
+  """Solves the checked routes on up to `workers` forked processes and
+  returns their results in order"""
+  indices = list(range(len(routes)))
+  workers = max(1, min(workers, len(indices)))
+  if workers == 1:
+    return [_solve_item(routes[index], distance_calculation, matrices[index]) for index in indices]
+
+  import multiprocessing
+  from multiprocessing.connection import wait
+  context = multiprocessing.get_context("fork")
+  results = [None] * len(routes)
+  running = {}
+  for worker in range(workers):
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+      target=_work, args=(indices[worker::workers], routes, distance_calculation, matrices, sender))
+    process.daemon = True
+    process.start()
+    sender.close()
+    running[receiver] = process
+  while running:
+    for receiver in wait(list(running)):
+      try:
+        index, result = receiver.recv()
+        results[index] = result
+      except EOFError:
+        # the worker is done, or died and its remaining routes stay None
+        running.pop(receiver).join()
+        receiver.close()
+  return [result if result is not None else {"status": 500, "title": "Route failed: worker exited"}
+          for result in results]
 
-      return return_lambda_gateway_response(200, {"route": cluster})
+def tsp_batch(event, context):
+  """Entry point of the batch: {"routes": [{"points": [...], ...}, ...]}"""
+  import multiprocessing
+  timer = timings.PhaseTimer("tsp_batch")
+  with timer.phase("parse"):
+    try:
+      body = event.get('body')
+      event = json.loads(body)
+
+      items = event["routes"]
+      # default of the routes that do not set their own
+      transport_mode = event.get("transport_mode", "1N1")
+      distance_calculation = event.get("distance_calculation", "VINCENTY")
+      workers = event.get("workers", multiprocessing.cpu_count())
+      # return the time spent in each phase in the response
+      timer.report = event.get("timings", False)
+    except KeyError as e:
+      print("Missing required input: " + str(e))
+      cluster = {"title": "Missing required input: " + str(e)}
+      return return_lambda_gateway_response(400, cluster, timer)
+
+  if isinstance(workers, bool) or not isinstance(workers, int):
+    cluster = {"title": "Invalid workers"}
+    return return_lambda_gateway_response(400, cluster, timer)
+  if workers <= 0:
+    cluster = {"title": "Numerical input must be positive"}
+    return return_lambda_gateway_response(400, cluster, timer)
+  if distance_calculation != "VINCENTY" and distance_calculation != "OSRM":
+    cluster = {"title": "Invalid distance_calculation"}
+    return return_lambda_gateway_response(400, cluster, timer)
+
+  results = [None] * len(items)
+  routes = []
+  positions = []
+  for position, item in enumerate(items):
+    try:
+      routes.append(_check_route(item, transport_mode))
+      positions.append(position)
+    except ValueError as e:
+      results[position] = {"status": 400, "title": str(e)}
+
+  with timer.phase("matrix"):
+    if distance_calculation == "VINCENTY":
+      matrices = _vincenty_matrices([points for points, mode, budget in routes])
     else:
-      print('No solution found.')
-  else:
-    print('Specify an instance greater than 0.')
\ No newline at end of file
+      # OSRM tables are fetched by the workers
+      matrices = [None] * len(routes)
+  for index in reversed(range(len(routes))):
+    if isinstance(matrices[index], ValueError):
+      print("Route failed: " + repr(matrices[index]))
+      results[positions[index]] = {"status": 500, "title": "Route failed: " + str(matrices[index])}
+      del routes[index], positions[index], matrices[index]
+  with timer.phase("solve"):
+    for position, result in zip(positions, solve_routes(routes, distance_calculation, matrices, workers)):
+      results[position] = result
+  print("Solved " + str(len(routes)) + " of " + str(len(items)) + " routes")
+
+  return return_lambda_gateway_response(200, {"routes": results}, timer)
@@ -0,0 +1,157 @@
+"""Exact and local search solvers for small TSP instances"""
+import os
+
+import lazy_imports
+
+np = lazy_imports.module("numpy")
+
+# routes of up to this many nodes (depot included) are solved exactly
+HELD_KARP_MAX_NODES = int(os.environ.get("TSP_HELD_KARP_MAX_NODES", 12))
+# up to this many nodes 2-opt and Or-opt replace OR-tools, 0 always uses it
+FAST_PATH_MAX_NODES = int(os.environ.get("TSP_FAST_PATH_MAX_NODES", 40))
+# longest run of stops Or-opt moves at once
+OR_OPT_SEGMENT = 3
+
+##############
+# Small TSPs #
+##############
+# Every solver returns the tour as the node order starting at the depot
+# (node 0), without the return to it. The tour is closed over the matrix,
+# so the transport modes only change the matrix: 1N has free arcs back to
+# the depot and N1 free arcs out of it, exactly what the routing model sees.
+
+def tour_cost(matrix, order):
+    order = np.asarray(order)
+    return int(matrix[order, np.roll(order, -1)].sum())
+
+def held_karp(matrix):
+    """The optimal tour by dynamic programming over the subsets of stops.
+
+    O(2^n n^2) time, vectorized per subset size and last stop.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    stops = len(matrix) - 1
+    if stops <= 1:
+        return list(range(len(matrix)))
+    full = 1 << stops
+    # cost[mask, j]: leave the depot, visit the stops of mask, end at stop j
+    cost = np.full((full, stops), np.inf)
+    parent = np.full((full, stops), -1, dtype=np.int64)
+    cost[1 << np.arange(stops), np.arange(stops)] = matrix[0, 1:]
+
+    masks = np.arange(full)
+    sizes = np.zeros(full, dtype=np.int64)
+    for stop in range(stops):
+        sizes += (masks >> stop) & 1
+    arcs = matrix[1:, 1:]
+    for size in range(2, stops + 1):
+        layer = masks[sizes == size]
+        for last in range(stops):
+            subsets = layer[(layer >> last) & 1 == 1]
+            # stops outside the previous subset are still inf
+            candidates = cost[subsets ^ (1 << last)] + arcs[:, last]
+            best = candidates.argmin(axis=1)
+            cost[subsets, last] = candidates[np.arange(len(subsets)), best]
+            parent[subsets, last] = best
+
+    last = int(np.argmin(cost[full - 1] + matrix[1:, 0]))
+    mask = full - 1
+    order = []
+    while last >= 0:
+        order.append(last + 1)
+        mask, last = mask ^ (1 << last), int(parent[mask, last])
+    return [0] + order[::-1]
+
+def nearest_neighbor(matrix):
+    """A first tour that always goes to the closest unvisited stop"""
+    size = len(matrix)
+    visited = np.zeros(size, dtype=bool)
+    visited[0] = True
+    order = [0]
+    for _ in range(size - 1):
+        distances = np.where(visited, np.inf, matrix[order[-1]])
+        order.append(int(distances.argmin()))
+        visited[order[-1]] = True
+    return order
+
+def two_opt(matrix, order):
+    """Reverses the best segment of the tour until no reversal shortens it.
+
+    The matrix may be asymmetric: the arcs inside a reversed segment are
+    priced in their new direction.
+    """
+    order = list(order)
+    size = len(order)
+    if size < 4:
+        return order
+    while True:
+        tour = np.array(order + [order[0]])
+        forward = matrix[tour[:-1], tour[1:]].astype(np.int64)
+        backward = matrix[tour[1:], tour[:-1]].astype(np.int64)
+        forward_sum = np.concatenate(([0], np.cumsum(forward)))
+        backward_sum = np.concatenate(([0], np.cumsum(backward)))
+        # reverse positions i..j (1 <= i < j <= size - 1), the depot stays first
+        i, j = np.triu_indices(size, 1)
+        keep = i >= 1
+        i, j = i[keep], j[keep]
+        before, first, last, after = tour[i - 1], tour[i], tour[j], tour[j + 1]
+        delta = (matrix[before, last] + matrix[first, after] - matrix[before, first] - matrix[last, after]
+                 + (backward_sum[j] - backward_sum[i]) - (forward_sum[j] - forward_sum[i]))
+        if not len(delta) or delta.min() >= 0:
+            return order
+        best = int(delta.argmin())
+        order[i[best]:j[best] + 1] = order[i[best]:j[best] + 1][::-1]
+
+def or_opt(matrix, order, segment=OR_OPT_SEGMENT):
+    """Moves the best run of 1..segment stops elsewhere in the tour until no
+    move shortens it"""
+    order = list(order)
+    size = len(order)
+    while True:
+        tour = np.array(order + [order[0]])
+        best = (0, None)
+        for length in range(1, min(segment, size - 2) + 1):
+            # the run is order[start:start + length], never the depot
+            starts = np.arange(1, size - length + 1)
+            before, first = tour[starts - 1], tour[starts]
+            last, after = tour[starts + length - 1], tour[starts + length]
+            removed = matrix[before, first] + matrix[last, after] - matrix[before, after]
+            # insert between positions p and p + 1 of the tour without the run
+            positions = np.arange(size)
+            start, position = np.meshgrid(starts, positions, indexing="ij")
+            outside = (position < start - 1) | (position >= start + length)
+            left = tour[position]
+            right = tour[np.where(position + 1 == start, start + length, position + 1)]
+            run_first = tour[start]
+            run_last = tour[start + length - 1]
+            added = matrix[left, run_first] + matrix[run_last, right] - matrix[left, right]
+            delta = np.where(outside, added - removed[:, None], 0).astype(np.int64)
+            move = np.unravel_index(int(delta.argmin()), delta.shape)
+            if delta[move] < best[0]:
+                best = (int(delta[move]), (int(starts[move[0]]), length, int(positions[move[1]])))
+        if best[1] is None:
+            return order
+        start, length, position = best[1]
+        run = order[start:start + length]
+        rest = order[:start] + order[start + length:]
+        # the position counted in the tour with the run still in it
+        at = position + 1 if position < start else position + 1 - length
+        order = rest[:at] + run + rest[at:]
+
+def local_search(matrix, order):
+    """Alternates 2-opt and Or-opt until neither improves the tour"""
+    cost = tour_cost(matrix, order)
+    while True:
+        order = or_opt(matrix, two_opt(matrix, order))
+        improved = tour_cost(matrix, order)
+        if improved >= cost:
+            return order
+        cost = improved
+
+def solve(matrix):
+    """The tour of a small instance: exact up to HELD_KARP_MAX_NODES nodes,
+    2-opt and Or-opt from the nearest neighbor tour above"""
+    matrix = np.asarray(matrix, dtype=np.int64)
+    if len(matrix) <= HELD_KARP_MAX_NODES:
+        return held_karp(matrix)
+    return local_search(matrix, nearest_neighbor(matrix))
@@ -1,51 +1,50 @@
 """Vehicle Routing Problem"""
 from __future__ import print_function
-from six.moves import xrange
-from ortools.constraint_solver import pywrapcp
-from ortools.constraint_solver import routing_enums_pb2
-
 
 import math
 import json
-
-#time for tester
-import time
+import functools
 
 import vrp_data_problem as data_problem
 import vrp_printer as printer
 import vrp_constraints
-
-def return_lambda_gateway_response(code, body):
+import routing_transits
+import solver_portfolio
+import search_control
+import warm_start
+import decomposition
+import timings
+
+def return_lambda_gateway_response(code, body, timer=None):
     """
     This function wraps around the endpoint responses in a uniform and Lambda-friendly way
     :param code: HTTP response code (200 for OK), must be an int
     :param body: the actual content of the response
+    :param timer: the request's timings.PhaseTimer, logged and added to the body if asked for
     """
-    return {"statusCode": code, "body": json.dumps(body)}
+    return {"statusCode": code, "body": json.dumps(timings.response_body(timer, code, body))}
 
 def get_routing_assignment(data, routing, assignment, distance_matrix, violated_points):
+    routes = solver_portfolio.assignment_routes(routing, assignment)
+    return get_routes_assignment(data, routes, distance_matrix, violated_points)
+
+def get_routes_assignment(data, routes, distance_matrix, violated_points):
+    """Builds the response from the stops of each vehicle, without depots"""
     cluster = []
     violated_cluster = []
-    for vehicle_id in xrange(data.num_vehicles):
-        if routing.IsVehicleUsed(assignment, vehicle_id):
-            index = routing.Start(vehicle_id)
-            if data.transport_mode == "N1":
-                index = assignment.Value(routing.NextVar(index))
+    for stops in routes:
+        if stops:
+            nodes = list(stops) if data.transport_mode == "N1" else [data.depot] + list(stops)
             route_dist = 0
             route_load = 0
             route = []
-            while not routing.IsEnd(index):
-                node_index = routing.IndexToNode(index)
-                next_node_index = routing.IndexToNode(
-                        assignment.Value(routing.NextVar(index)))
+            for node_index, next_node_index in zip(nodes, nodes[1:] + [data.depot]):
                 route_dist += distance_matrix[node_index][next_node_index]
-                route_load += data.parcels[node_index]            
+                route_load += data.parcels[node_index]
                 route.append([data.locations[node_index][0], data.locations[node_index][1]])
-                index = assignment.Value(routing.NextVar(index))
 
             if data.transport_mode != "1N1":
-                node_index = routing.IndexToNode(index)
-                route.append([data.locations[node_index][0], data.locations[node_index][1]])
+                route.append([data.locations[data.depot][0], data.locations[data.depot][1]])
             if (data.maximum_distance != 0 and route_dist > data.maximum_distance) or (route_load < data.min_parcels):
                 violated_cluster.append(route)
             else:
@@ -56,51 +55,104 @@ def get_routing_assignment(data, routing, assignment, distance_matrix, violated_
         "violated_cluster": violated_cluster 
     }
 
+def create_routing_model(data, distance, min_vehicles, soft):
+    """Creates the routing model, with a soft distance limit when soft is set"""
+    routing = routing_transits.routing_model(data.num_locations, data.num_vehicles, data.depot)
+
+    routing_transits.set_arc_costs(routing, distance.get_arc_cost_matrix(data.num_locations > 100))
+
+    if data.maximum_distance != 0:
+        if soft:
+            vrp_constraints.add_distance_soft(routing, data, distance.get_distance_matrix())
+        else:
+            vrp_constraints.add_distance_dimension(routing, data, distance.get_distance_matrix())
+    # still need when min_parcels = 0 because we have max_parcels
+    vrp_constraints.add_parcels_constraints(routing, data)
+
+    #minimize the total number of vehicle
+    if min_vehicles:
+        if data.num_vehicles*data.min_parcels >= data.num_locations:
+            routing.SetFixedCostOfAllVehicles(1000000)
+        elif soft:
+            routing.SetFixedCostOfAllVehicles(100)
+        else:
+            routing.SetFixedCostOfAllVehicles(10000)
+    return routing
+
+def solve(data, distance, min_vehicles, soft, portfolio_workers, time_limit_ms, initial_routes=None, timer=None):
+    """Solves one formulation, on several cores when portfolio_workers > 1"""
+    timer = timer or timings.PhaseTimer("vrp")
+    model = "soft" if soft else "hard"
+    build = functools.partial(create_routing_model, data, distance, min_vehicles, soft)
+    if portfolio_workers > 1:
+        # the workers build their own models
+        with timer.phase("solve_" + model):
+            routing, assignment, configuration = solver_portfolio.solve(
+                build, portfolio_workers, time_limit_ms, initial_routes)
+        return routing, assignment
+
+    with timer.phase("model_" + model):
+        routing = build()
+        # Setting first solution heuristic (cheapest addition).
+        search_parameters = solver_portfolio.search_parameters(routing, time_limit_ms)
+    with timer.phase("solve_" + model):
+        return routing, search_control.solve(routing, search_parameters, initial_routes)
+
 def handle(event, context):
 
-    start_time = time.time()
+    timer = timings.PhaseTimer("vrp")
     """Entry point of the program"""
     # Instantiate the data problem.
-    try:
-        body = event.get('body')
-        event = json.loads(body)
-
-        locations = event["points"]
-        min_parcels = event.get("min_parcels", 0)
-        maximum_distance = event.get("max_distance", 0)
-        num_vehicles = event["vehicle_num"]
-        min_vehicles = event.get("min_vehicles", False)
-        max_parcels = event.get("max_parcels", 20)
-        transport_mode = event["transport_mode"]
-        distance_calculation = event.get("distance_calculation", "VINCENTY")
-    except KeyError as e:
-        print("Missing required input: " + str(e))
-        cluster = {"title": "Missing required input: " + str(e)}
-        return return_lambda_gateway_response(400, cluster)
-
-    if min_parcels < 0 or maximum_distance < 0 or num_vehicles < 0 or max_parcels < 0:
+    with timer.phase("parse"):
+        try:
+            body = event.get('body')
+            event = json.loads(body)
+
+            locations = event["points"]
+            min_parcels = event.get("min_parcels", 0)
+            maximum_distance = event.get("max_distance", 0)
+            num_vehicles = event["vehicle_num"]
+            min_vehicles = event.get("min_vehicles", False)
+            max_parcels = event.get("max_parcels", 20)
+            transport_mode = event["transport_mode"]
+            distance_calculation = event.get("distance_calculation", "VINCENTY")
+            # solve on several cores, each solve phase limited to time_budget_ms
+            portfolio_workers = event.get("portfolio_workers", 1)
+            time_budget_ms = event.get("time_budget_ms", 0)
+            # solve the soft distance model alongside the hard one from the start
+            parallel_soft = event.get("parallel_soft", False)
+            # the "cluster" of an earlier response for the same day, if any
+            previous_cluster = event.get("previous_cluster")
+            # solve this many sweep sectors around the depot separately
+            sectors = event.get("sectors", 0)
+            # only price arcs to each stop's k nearest neighbors normally
+            neighbors = event.get("neighbors", 0)
+            # return the time spent in each phase in the response
+            timer.report = event.get("timings", False)
+        except KeyError as e:
+            print("Missing required input: " + str(e))
+            cluster = {"title": "Missing required input: " + str(e)}
+            return return_lambda_gateway_response(400, cluster, timer)
+
+    if min_parcels < 0 or maximum_distance < 0 or num_vehicles < 0 or max_parcels < 0 \
+            or portfolio_workers < 0 or time_budget_ms < 0 or sectors < 0 or neighbors < 0:
         cluster = {"title": "Numerical input cannot be negative"}
-        return return_lambda_gateway_response(400, cluster)
+        return return_lambda_gateway_response(400, cluster, timer)
 
     if transport_mode != "1N" and transport_mode != "N1" and transport_mode != "1N1":
         cluster = {"title": "Invalid transport_mode"}
-        return return_lambda_gateway_response(400, cluster)
+        return return_lambda_gateway_response(400, cluster, timer)
 
     if distance_calculation != "VINCENTY" and distance_calculation != "OSRM":
         cluster = {"title": "Invalid distance_calculation"}
-        return return_lambda_gateway_response(400, cluster)
-
-    if distance_calculation == "OSRM" and len(locations) > 100:
-        cluster = {"title": "Bad request: OSRM cannot be used with more than 100 points"}
-        return return_lambda_gateway_response(400, cluster)
+        return return_lambda_gateway_response(400, cluster, timer)
 
     data = data_problem.DataProblem(locations, num_vehicles, min_parcels, 
         max_parcels, maximum_distance, transport_mode, distance_calculation)
     
     # Define weight of each edge
-    distance = vrp_constraints.CreateDistanceEvaluator(data)
+    distance = vrp_constraints.CreateDistanceEvaluator(data, neighbors, timer)
     distance_matrix = distance.get_distance_matrix()
-    distance_evaluator = distance.distance_evaluator
     print("Violated points: " + str(distance.get_violated_points))
 
     if len(data.locations) <= 1:
@@ -109,72 +161,86 @@ def handle(event, context):
             "violated_points": distance.get_violated_points,
             "violated_cluster": []
         }
-        return return_lambda_gateway_response(200, cluster)
-
-    # Create Routing Model
-    routing = pywrapcp.RoutingModel(data.num_locations, data.num_vehicles, data.depot)
-    
-    if data.num_locations > 100:
-        routing.SetArcCostEvaluatorOfAllVehicles(distance.cluster_distance_evaluator)
-    else:
-        routing.SetArcCostEvaluatorOfAllVehicles(distance_evaluator)
-
-    if maximum_distance != 0:
-        vrp_constraints.add_distance_dimension(routing, data, distance_evaluator)
-    # still need when min_parcels = 0 because we have max_parcels
-    parcels_evaluator = vrp_constraints.CreateParcelsEvaluator(data).parcels_evaluator
-    vrp_constraints.add_parcels_constraints(routing, data, parcels_evaluator)
-
-    # Setting first solution heuristic (cheapest addition).
-    search_parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
-    search_parameters.time_limit_ms = 25000
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_MOST_CONSTRAINED_ARC)
-
-    #minimize the total number of vehicle
-    if min_vehicles:
-        if data.num_vehicles*data.min_parcels >= data.num_locations:
-            routing.SetFixedCostOfAllVehicles(1000000)
-        else:
-            routing.SetFixedCostOfAllVehicles(10000)
+        return return_lambda_gateway_response(200, cluster, timer)
+
+    # the request's time_budget_ms, or a budget picked from the instance size
+    hard_time_limit_ms = time_budget_ms or search_control.time_budget_ms(data.num_locations, data.num_vehicles, 25000)
+    soft_time_limit_ms = time_budget_ms or search_control.time_budget_ms(data.num_locations, data.num_vehicles, 60000)
+
+    with timer.phase("feasibility"):
+        infeasible = vrp_constraints.capacity_infeasibility(data)
+    if infeasible:
+        print("No model can fit the parcels: " + infeasible)
+        return return_lambda_gateway_response(200, "No solution found", timer)
+
+    with timer.phase("feasibility"):
+        infeasible = vrp_constraints.distance_infeasibility(data, distance_matrix)
+    if infeasible:
+        print("Hard distance limit cannot be met: " + infeasible)
+
+    if sectors > 1 and data.num_locations > sectors:
+        if previous_cluster or parallel_soft:
+            print("previous_cluster and parallel_soft only apply if the sectors fall back to one model")
+        with timer.phase("decomposition"):
+            decomposed = decomposition.solve(
+                data, distance, min_vehicles, sectors, hard_time_limit_ms, create_routing_model, portfolio_workers)
+        if decomposed is not None:
+            routes, model = decomposed
+            with timer.phase("extraction"):
+                cluster = get_routes_assignment(data, routes, distance_matrix, distance.get_violated_points)
+            cluster["model"] = model
+            print("\nThe program took " + str(timer.elapsed()) + " seconds to run")
+            return return_lambda_gateway_response(200, cluster, timer)
+        print("Solving without sectors")
+
+    initial_routes = None
+    if previous_cluster:
+        with timer.phase("warm_start"):
+            routes, missing = warm_start.map_routes(previous_cluster, data.locations, data.num_vehicles)
+            print("Previous plan: " + str(data.num_locations - 1 - len(missing)) + " stops kept, "
+                  + str(len(missing)) + " new")
+            initial_routes = warm_start.insert_cheapest(
+                routes, missing, distance_matrix, data.num_vehicles,
+                data.parcels, data.max_parcels - data.parcels[0])
+
+    if parallel_soft and not infeasible:
+        soft = solver_portfolio.start(
+            functools.partial(create_routing_model, data, distance, min_vehicles, True),
+            portfolio_workers, soft_time_limit_ms, initial_routes)
 
     # Solve the problem.
-    assignment = routing.SolveWithParameters(search_parameters)
+    model = "hard"
+    assignment = None
+    if not infeasible:
+        routing, assignment = solve(
+            data, distance, min_vehicles, False, portfolio_workers, hard_time_limit_ms, initial_routes, timer)
 
     if assignment is None:
         print("change distance to soft constraint")
-        print("\nThe program took " + str(time.time() - start_time) + " seconds to run")
-        start_time = time.time()
-        routing = pywrapcp.RoutingModel(data.num_locations, data.num_vehicles, data.depot)
-
-        if data.num_locations > 100:
-            routing.SetArcCostEvaluatorOfAllVehicles(distance.cluster_distance_evaluator)
+        print("\nThe program took " + str(timer.elapsed()) + " seconds to run")
+        model = "soft"
+        if parallel_soft and not infeasible:
+            # it has been solving since the start, only the wait is timed
+            with timer.phase("solve_soft"):
+                routing, assignment, configuration = soft.result()
         else:
-            routing.SetArcCostEvaluatorOfAllVehicles(distance_evaluator)
-        if maximum_distance != 0:
-            vrp_constraints.add_distance_soft(routing, data, distance_evaluator)
-        parcels_evaluator = vrp_constraints.CreateParcelsEvaluator(data).parcels_evaluator
-        vrp_constraints.add_parcels_constraints(routing, data, parcels_evaluator)
-
-        search_parameters = pywrapcp.RoutingModel.DefaultSearchParameters()
-        search_parameters.time_limit_ms = 60000
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_MOST_CONSTRAINED_ARC)
-        if min_vehicles:
-            if data.num_vehicles*data.min_parcels >= data.num_locations:
-                routing.SetFixedCostOfAllVehicles(1000000)
-            else:
-                routing.SetFixedCostOfAllVehicles(100)
-        assignment = routing.SolveWithParameters(search_parameters)
+            routing, assignment = solve(
+                data, distance, min_vehicles, True, portfolio_workers, soft_time_limit_ms, initial_routes, timer)
+    elif parallel_soft:
+        soft.cancel()
 
     if assignment is None:
         print("No solution found")
         cluster = "No solution found"
     else:
-        cluster = get_routing_assignment(data, routing, assignment, distance_matrix, distance.get_violated_points)
-        p = printer.ConsolePrinter(data, routing, assignment, distance_matrix)
-        p.print()
+        with timer.phase("extraction"):
+            cluster = get_routing_assignment(data, routing, assignment, distance_matrix, distance.get_violated_points)
+        cluster["model"] = model
+        timer.objective = assignment.ObjectiveValue()
+        with timer.phase("printing"):
+            p = printer.ConsolePrinter(data, routing, assignment, distance_matrix)
+            p.print()
 
-    print("\nThe program took " + str(time.time() - start_time) + " seconds to run")
+    print("\nThe program took " + str(timer.elapsed()) + " seconds to run")
 
-    return return_lambda_gateway_response(200, cluster)
\ No newline at end of file
+    return return_lambda_gateway_response(200, cluster, timer)
\ No newline at end of file
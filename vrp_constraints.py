@@ -1,96 +1,106 @@
 from __future__ import print_function
-from six.moves import xrange
-from ortools.constraint_solver import pywrapcp
-from ortools.constraint_solver import routing_enums_pb2
 
-#for http requests
-import urllib.request
-import json
+import functools
 
 import sys
-from geopy.distance import vincenty
+import barriers
+import distance_matrix
+import lazy_imports
+import matrix_cache
+import routing_transits
+import spatial_index
+import timings
+
+np = lazy_imports.module("numpy")
+
+# extra cost of an arc outside the k nearest neighbors of its nodes
+NEIGHBOR_PENALTY = 100000
 
 #######################
 # Problem Constraints #
 #######################
-def vincenty_distance(pos_1, pos_2):
-    pos_1 = (pos_1[0], pos_1[1])
-    pos_2 = (pos_2[0], pos_2[1])
-    return vincenty(pos_1, pos_2).meters
-
 class CreateDistanceEvaluator(object): # pylint: disable=too-few-public-methods
     """Creates callback to return distance between points."""
-    def __init__(self, data):
-        """Initializes the distance matrix."""
+    def __init__(self, data, neighbors=0, timer=None):
+        """Initializes the distance matrix.
+
+        With neighbors > 0 only the arcs between each node and its k nearest
+        neighbors (and the depot) are priced normally; the VINCENTY backend
+        then computes exact distances for those arcs only. The time spent
+        goes to the "filter" and "matrix" phases of timer.
+        """
+        timer = timer or timings.PhaseTimer("distance")
         self._distances = {}
         self._violated_points = []
+        self._neighbors = None
+        self._crossings = None
 
         # complete distance matrix
         # precompute distance between location to have distance callback in O(1)
         if data.distance_calculation == "OSRM":
+            import osrm_client
+            with timer.phase("matrix"):
+                contents = distance_matrix.osrm_distances(
+                    data.locations, functools.partial(osrm_client.table, data.locations), matrix_cache.default_cache())
+                self._distances = distance_matrix.DistanceMatrix.from_rows(
+                    contents,
+                    ignore_from_depot=data.transport_mode == "N1",
+                    ignore_to_depot=data.transport_mode == "1N")
 
             #filter out violated points
-            url = "https://bi.ahamove.com/osrm/table/v1/driving/"
-            for loc in data.locations:
-                url += str(loc[1]) + "," + str(loc[0]) + ";"
-            url = url[:-1] + "?annotations=distance"
-            response = urllib.request.urlopen(url).read().decode('UTF-8')
-            contents = json.loads(response)["distances"]
-
-            if data.maximum_distance != 0:
-                remove = []
-                for index in xrange(data.num_locations):
-                    min_distance = contents[index][0]
-                    if min_distance > data.maximum_distance:
-                        self._violated_points.append(data.locations[index])
-                        remove.append(index)
-                for index in sorted(remove, reverse=True):
-                    data.remove_location(index)
-
-            # only continue when there are more than 1 points in the dataset
-            if len(data.locations) > 1:
-
-                url = "https://bi.ahamove.com/osrm/table/v1/driving/"
-                for loc in data.locations:
-                    url += str(loc[1]) + "," + str(loc[0]) + ";"
-                url = url[:-1] + "?annotations=distance"
-                response = urllib.request.urlopen(url).read().decode('UTF-8')
-                contents = json.loads(response)["distances"]
-                
-                if data.transport_mode == "N1":
-                    for index in xrange(data.num_locations):
-                        contents[0][index] = 0
-
-                if data.transport_mode == "1N":
-                    for index in xrange(data.num_locations):
-                        contents[index][0] = 0
-
-                self._distances = contents
+            # (drop their rows and columns instead of asking OSRM again)
+            with timer.phase("filter"):
+                if data.maximum_distance != 0:
+                    remove = []
+                    for index in range(data.num_locations):
+                        min_distance = contents[index][0]
+                        # nan when OSRM has no route back to the depot
+                        if not min_distance <= data.maximum_distance:
+                            self._violated_points.append(data.locations[index])
+                            remove.append(index)
+                    for index in sorted(remove, reverse=True):
+                        data.remove_location(index)
+                        self._distances.remove(index)
+            # the full table is fetched anyway, only the arc costs change
+            if neighbors > 0 and len(data.locations) > 1:
+                with timer.phase("matrix"):
+                    self._neighbors = spatial_index.neighbor_arcs(data.locations, neighbors)
         else:
-            if data.maximum_distance != 0:
-                remove = []
-                for index in xrange(data.num_locations):
-                    min_distance = (vincenty_distance(data.locations[0], data.locations[index]))
-                    if min_distance > data.maximum_distance:
-                        self._violated_points.append(data.locations[index])
-                        remove.append(index)
-                for index in sorted(remove, reverse=True):
-                    data.remove_location(index)
-
-            # only continue when there are more than 1 points in the dataset
-            if len(data.locations) > 1:
-                for from_node in xrange(data.num_locations):
-                    self._distances[from_node] = {}
-                    for to_node in xrange(data.num_locations):
-                        # ignore distance from depot to others
-                        # (we assign to driver that near the first point in the route)
-                        if (from_node == to_node) or (data.transport_mode == "1N" and to_node == 0) or (data.transport_mode == "N1" and from_node == 0):
-                            self._distances[from_node][to_node] = 0
-                        else:
-                            distance = (vincenty_distance(
-                                    data.locations[from_node],
-                                    data.locations[to_node]))
-                            self._distances[from_node][to_node] = distance
+            with timer.phase("filter"):
+                if data.maximum_distance != 0:
+                    remove = []
+                    depot_distances = distance_matrix.vincenty_from(data.locations[0], data.locations)
+                    for index in range(data.num_locations):
+                        min_distance = depot_distances[index]
+                        if min_distance > data.maximum_distance:
+                            self._violated_points.append(data.locations[index])
+                            remove.append(index)
+                    for index in sorted(remove, reverse=True):
+                        data.remove_location(index)
+
+            with timer.phase("matrix"):
+                # only continue when there are more than 1 points in the dataset
+                if len(data.locations) > 1 and neighbors > 0:
+                    self._neighbors = spatial_index.neighbor_arcs(data.locations, neighbors)
+                    # straight-line estimates, exact distances on the allowed arcs
+                    values = spatial_index.estimate_distances(data.locations)
+                    rows, cols = np.nonzero(np.triu(self._neighbors, 1))
+                    values[rows, cols] = distance_matrix.vincenty_arcs(
+                        data.locations, rows, cols, matrix_cache.default_cache())
+                    values[cols, rows] = values[rows, cols]
+                    self._distances = distance_matrix.DistanceMatrix(
+                        values,
+                        ignore_from_depot=data.transport_mode == "N1",
+                        ignore_to_depot=data.transport_mode == "1N")
+                elif len(data.locations) > 1:
+                    # ignore distance from depot to others
+                    # (we assign to driver that near the first point in the route)
+                    self._distances = distance_matrix.DistanceMatrix.from_locations(
+                        data.locations,
+                        ignore_from_depot=data.transport_mode == "N1",
+                        ignore_to_depot=data.transport_mode == "1N",
+                        cache=matrix_cache.default_cache())
+        self._locations = list(data.locations)
 
     @property
     def get_violated_points(self):
@@ -99,65 +109,110 @@ class CreateDistanceEvaluator(object): # pylint: disable=too-few-public-methods
     def get_distance_matrix(self):
         return self._distances
 
-    def distance_evaluator(self, from_node, to_node):
-        return self._distances[from_node][to_node]
+    def get_crossings(self):
+        """The arcs crossing a barrier of barriers.BARRIER_FILE, None without one"""
+        if self._crossings is None:
+            self._crossings = barriers.crossings(self._locations)
+        return self._crossings
 
     # add cost if in cluster mode
-    def cluster_distance_evaluator(self, from_node, to_node):
+    def get_cluster_distance_matrix(self):
+        return cluster_distance_matrix(self._distances, self.get_crossings())
+
+    def get_arc_cost_matrix(self, cluster):
+        """The (cluster) distances, penalized outside the nearest neighbors"""
+        matrix = self.get_cluster_distance_matrix() if cluster else self._distances
+        if self._neighbors is None:
+            return matrix
+        return distance_matrix.DistanceMatrix(matrix.values + NEIGHBOR_PENALTY * ~self._neighbors)
+
+def cluster_distance_matrix(matrix, crossings=None, penalty=10000):
+    """Adds penalty to the arcs crossing a barrier, or to those over 500m without barriers"""
+    distances = matrix.values
+    if crossings is None:
         # if distance more than 500m -> potential for crossing the river -> add more cost
-        if self._distances[from_node][to_node] > 500:
-            return self._distances[from_node][to_node] + 10000
-        else:
-            return self._distances[from_node][to_node]
+        crossings = distances > 500
+    else:
+        # the arcs the transport mode ignores stay free
+        crossings = crossings & (distances > 0)
+    return distance_matrix.DistanceMatrix(distances + penalty * crossings)
 
-def add_distance_dimension(routing, data, distance_evaluator):
+def add_distance_dimension(routing, data, matrix):
     """Add Global Span constraint"""
     distance = "Distance"
-    routing.AddDimension(
-        distance_evaluator,
-        0, # null slack
+    routing_transits.add_matrix_dimension(
+        routing,
+        matrix,
         data.maximum_distance, # maximum distance per vehicle
-        True, # start cumul to zero
         distance)
 
-def add_distance_soft(routing, data, distance_evaluator):
+def add_distance_soft(routing, data, matrix):
     distance = "Distance"
-    routing.AddDimension(
-        distance_evaluator,
-        0, # null slack
+    distance_dimension = routing_transits.add_matrix_dimension(
+        routing,
+        matrix,
         sys.maxsize, # maximum distance per vehicle
-        True, # start cumul to zero
         distance)
 
-    distance_dimension = routing.GetDimensionOrDie(distance)
-    for vehicle_id in xrange(data.num_vehicles):
+    for vehicle_id in range(data.num_vehicles):
         distance_dimension.SetEndCumulVarSoftUpperBound(vehicle_id, data.maximum_distance, 10000)
     #distance_dimension.SetGlobalSpanCostCoefficient(data.num_locations*100)
 
-class CreateParcelsEvaluator(object):
-    """Creates callback to get parcels at each location."""
-    def __init__(self, data):
-        """Initializes the parcels array."""
-        self._parcels = data.parcels
-
-    def parcels_evaluator(self, from_node, to_node):
-        del to_node
-        return self._parcels[from_node]
-
-def add_parcels_constraints(routing, data, parcels_evaluator):
+def add_parcels_constraints(routing, data):
     parcels = "Parcels"
-    routing.AddDimension(
-        parcels_evaluator,
-        0, # null capacity slack
+    parcels_dimension = routing_transits.add_vector_dimension(
+        routing,
+        data.parcels, # parcels picked up at each location
         data.max_parcels, # vehicle maximum capacity
-        True, # start cumul to zero
         parcels)
 
-    parcels_dimension = routing.GetDimensionOrDie(parcels)
     # cost = 0 if cumul > min_parcels
     if data.min_parcels != 0:
-        for vehicle_id in xrange(data.num_vehicles):
+        for vehicle_id in range(data.num_vehicles):
             if data.maximum_distance == 0:
                 parcels_dimension.SetEndCumulVarSoftLowerBound(vehicle_id, data.min_parcels, 10000000)
             else:
-                parcels_dimension.SetEndCumulVarSoftLowerBound(vehicle_id, data.min_parcels, 10000) 
\ No newline at end of file
+                parcels_dimension.SetEndCumulVarSoftLowerBound(vehicle_id, data.min_parcels, 10000)
+
+######################
+# Feasibility Bounds #
+######################
+# Cheap necessary conditions checked before solving. Parcels are a hard
+# capacity in both models, so breaking a capacity bound means no model can
+# succeed; the distance bounds only rule out the hard distance limit.
+# min_parcels is a soft lower bound in both models and never makes them
+# infeasible.
+
+def capacity_infeasibility(data):
+    """Returns why the parcels cannot fit in the vehicles, or None"""
+    # the depot transit is counted once by every vehicle, used or not
+    capacity = data.max_parcels - data.parcels[0]
+    if capacity < 0:
+        return "depot parcels {0} > max_parcels {1}".format(data.parcels[0], data.max_parcels)
+    total = sum(data.parcels[1:])
+    if total > data.num_vehicles * capacity:
+        return "total parcels {0} > {1} vehicles x {2} free capacity".format(
+            total, data.num_vehicles, capacity)
+    largest = max(data.parcels[1:]) if data.num_locations > 1 else 0
+    if largest > capacity:
+        return "a stop has {0} parcels > {1} free capacity".format(largest, capacity)
+    return None
+
+def distance_infeasibility(data, matrix):
+    """Returns why the hard distance limit cannot be met, or None"""
+    if data.maximum_distance == 0 or data.num_locations <= 1:
+        return None
+    values = matrix.values.astype(np.int64)
+    # out from the depot and back, with the arcs the transport mode ignores
+    # already zeroed in the matrix
+    round_trips = values[0, 1:] + values[1:, 0]
+    if round_trips.max() > data.maximum_distance:
+        return "depot round trip of {0} m > max_distance {1}".format(
+            round_trips.max(), data.maximum_distance)
+    # every stop is entered exactly once, at least through its shortest arc
+    np.fill_diagonal(values, np.iinfo(np.int64).max)
+    incoming = values[:, 1:].min(axis=0).sum()
+    if incoming > data.num_vehicles * data.maximum_distance:
+        return "shortest incoming arcs sum to {0} m > {1} vehicles x max_distance {2}".format(
+            incoming, data.num_vehicles, data.maximum_distance)
+    return None
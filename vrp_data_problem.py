@@ -62,4 +62,5 @@ class DataProblem():
 
     # remove a point from locations list
     def remove_location(self, index):
-        del self._locations[index]
\ No newline at end of file
+        del self._locations[index]
+        del self._parcels[index]
\ No newline at end of file
@@ -1,7 +1,4 @@
 from __future__ import print_function
-from six.moves import xrange
-from ortools.constraint_solver import pywrapcp
-from ortools.constraint_solver import routing_enums_pb2
 
 ###########
 # Printer #
@@ -39,7 +36,7 @@ class ConsolePrinter():
         """Prints assignment on console"""
         # Inspect solution.
         total_dist = 0
-        for vehicle_id in xrange(self.data.num_vehicles):
+        for vehicle_id in range(self.data.num_vehicles):
             index = self.routing.Start(vehicle_id)
             if self.data.transport_mode == "N1":
                 index = self.assignment.Value(self.routing.NextVar(index))
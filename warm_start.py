@@ -0,0 +1,121 @@
+"""Maps a previous plan onto a new request as the initial solution"""
+from __future__ import print_function
+
+# coordinates are compared after rounding to 6 decimals (~0.1 m)
+PRECISION = 6
+
+##############
+# Warm Start #
+##############
+# The previous plan is the "cluster" of an earlier response: one list of
+# stops per vehicle, each stop given by its coordinates or, for the pick up
+# and delivery handlers, by its order label ("3-0", "3-1"). Stops that are
+# gone are dropped, new stops are added by cheapest insertion, and the
+# result is a list of node routes for ReadAssignmentFromRoutes.
+
+def _coordinate_key(location):
+    return (round(float(location[0]), PRECISION), round(float(location[1]), PRECISION))
+
+def map_routes(previous, locations, num_vehicles, labels=None):
+    """Maps the stops of previous onto node indices.
+
+    labels maps nodes to their order label and is used for stops given as
+    strings. The depot, stops that are not in the request any more, repeats
+    and routes past num_vehicles are dropped. Returns (routes, missing)
+    where missing are the nodes no route visits.
+    """
+    nodes = {}
+    for node in range(1, len(locations)):
+        nodes.setdefault(_coordinate_key(locations[node]), []).append(node)
+        if labels is not None:
+            nodes.setdefault(labels[node], []).append(node)
+
+    used = set()
+    routes = []
+    for route in previous[:num_vehicles]:
+        mapped = []
+        for stop in route:
+            key = stop if isinstance(stop, str) else _coordinate_key(stop)
+            for node in nodes.get(key, []):
+                if node not in used:
+                    used.add(node)
+                    mapped.append(node)
+                    break
+        routes.append(mapped)
+    missing = [node for node in range(1, len(locations)) if node not in used]
+    return routes, missing
+
+def _insertion_costs(matrix, route, node):
+    """Extra distance of inserting node at each position of route"""
+    path = [0] + route + [0]
+    return [matrix.get(path[i], node) + matrix.get(node, path[i + 1]) - matrix.get(path[i], path[i + 1])
+            for i in range(len(path) - 1)]
+
+def insert_cheapest(routes, missing, matrix, num_vehicles, demands=None, capacity=None):
+    """Inserts every missing node where it adds the least distance.
+
+    With demands, a node only goes into routes whose load stays within
+    capacity. Returns the new routes, or None when a node fits nowhere.
+    """
+    routes = [list(route) for route in routes] + [[] for _ in range(num_vehicles - len(routes))]
+    loads = [sum(demands[node] for node in route) if demands is not None else 0 for route in routes]
+    for node in missing:
+        best = None
+        for vehicle_id, route in enumerate(routes):
+            if demands is not None and loads[vehicle_id] + demands[node] > capacity:
+                continue
+            costs = _insertion_costs(matrix, route, node)
+            position = costs.index(min(costs))
+            if best is None or costs[position] < best[0]:
+                best = (costs[position], vehicle_id, position)
+        if best is None:
+            return None
+        cost, vehicle_id, position = best
+        routes[vehicle_id].insert(position, node)
+        if demands is not None:
+            loads[vehicle_id] += demands[node]
+    return routes
+
+def split_pairs(routes, pairs):
+    """Removes the pickup and delivery pairs that are broken in routes.
+
+    A pair is kept when both nodes are on the same route with the pickup
+    first. Returns (routes, broken pairs).
+    """
+    position = {}
+    for vehicle_id, route in enumerate(routes):
+        for order, node in enumerate(route):
+            position[node] = (vehicle_id, order)
+    broken = [(pickup, delivery) for pickup, delivery in pairs
+              if pickup not in position or delivery not in position
+              or position[pickup][0] != position[delivery][0]
+              or position[pickup][1] > position[delivery][1]]
+    dropped = set(node for pair in broken for node in pair)
+    return [[node for node in route if node not in dropped] for route in routes], broken
+
+def insert_pairs(routes, pairs, matrix, num_vehicles):
+    """Inserts every pickup and delivery pair where it adds the least distance"""
+    routes = [list(route) for route in routes] + [[] for _ in range(num_vehicles - len(routes))]
+    for pickup, delivery in pairs:
+        best = None
+        for vehicle_id, route in enumerate(routes):
+            pickup_costs = _insertion_costs(matrix, route, pickup)
+            for i, pickup_cost in enumerate(pickup_costs):
+                with_pickup = route[:i] + [pickup] + route[i:]
+                delivery_costs = _insertion_costs(matrix, with_pickup, delivery)
+                for j in range(i + 1, len(delivery_costs)):
+                    cost = pickup_cost + delivery_costs[j]
+                    if best is None or cost < best[0]:
+                        best = (cost, vehicle_id, i, j)
+        cost, vehicle_id, i, j = best
+        routes[vehicle_id].insert(i, pickup)
+        routes[vehicle_id].insert(j, delivery)
+    return routes
+
+def initial_assignment(routing, search_parameters, routes):
+    """Closes the model and restores routes into it, None if they are infeasible"""
+    routing.CloseModelWithParameters(search_parameters)
+    assignment = routing.ReadAssignmentFromRoutes(routes, True)
+    if assignment is None:
+        print("The previous plan does not fit this request, solving from scratch")
+    return assignment